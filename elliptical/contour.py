@@ -0,0 +1,389 @@
+"""contour
+
+multi-level contour extraction (marching squares) in a single sweep
+
+ContourSweep :
+  classify every image cell against every requested level at once,
+  then assemble the contours of any one level from only the cells it crosses
+
+find_contours_levels :
+  convenience wrapper returning the contours for each level
+
+find_contours_cells :
+  the contours of one level, traced through a given set of cells only
+
+first_contour_points :
+  the points of the first of those contours, found without assembling
+  the contours in Python
+
+
+the segment and assembly conventions follow skimage.measure.find_contours
+(fully_connected='low', positive_orientation='low'), so the output
+contours are identical, point for point and in the same order.
+
+"""
+
+from collections import deque
+
+import numpy as np
+
+
+# marching-squares lookup: for each of the 16 cell cases, the edges
+# (0=top, 1=bottom, 2=left, 3=right) joined by the first and second
+# segments. -1 means no segment. cases 6 and 9 are the saddles.
+_SEGMENT_FROM = np.array([[-1,-1],[0,-1],[3,-1],[3,-1],
+                          [2,-1],[0,-1],[3, 2],[3,-1],
+                          [1,-1],[0, 1],[1,-1],[1,-1],
+                          [2,-1],[0,-1],[2,-1],[-1,-1]])
+
+_SEGMENT_TO   = np.array([[-1,-1],[2,-1],[0,-1],[2,-1],
+                          [1,-1],[1,-1],[0, 1],[1,-1],
+                          [3,-1],[2, 3],[0,-1],[2,-1],
+                          [3,-1],[3,-1],[0,-1],[-1,-1]])
+
+
+class ContourSweep(object):
+    '''single-sweep contour engine
+
+    a cell (the square between four neighbouring pixels) is crossed by a
+    level if min(corners) <= level < max(corners). Sorting the levels, one
+    searchsorted of the cell minima and maxima finds the run of levels
+    each cell crosses, so the whole image is visited once for all levels,
+    and each level afterwards only touches the cells it crosses.
+
+    cells with a NaN corner are skipped, as in skimage.
+
+    '''
+
+    def __init__(self,Z,levels):
+        """classify the cells of Z against all levels
+
+        inputs
+        ------------
+        Z          : (2d array) surface density values
+        levels     : (1d array) the contour levels that will be requested
+
+        """
+
+        self.Z      = np.ascontiguousarray(Z,dtype=np.float64)
+        self.levels = np.unique(np.asarray(levels,dtype=np.float64))
+
+        if self.Z.ndim != 2 or self.Z.shape[0] < 2 or self.Z.shape[1] < 2:
+            raise ValueError('elliptical.contour.ContourSweep: Z must be a 2d array of at least 2x2.')
+
+        ul,ur = self.Z[:-1,:-1],self.Z[:-1,1:]
+        ll,lr = self.Z[1:,:-1] ,self.Z[1:,1:]
+
+        # NaN propagates through minimum/maximum, and searchsorted puts it
+        # past the last level, so NaN cells cross nothing
+        cmin = np.minimum(np.minimum(ul,ur),np.minimum(ll,lr)).ravel()
+        cmax = np.maximum(np.maximum(ul,ur),np.maximum(ll,lr)).ravel()
+
+        # the range of levels crossed by each cell: [lo,hi)
+        lo = np.searchsorted(self.levels,cmin,side='left')
+        hi = np.searchsorted(self.levels,cmax,side='left')
+
+        cells = np.flatnonzero(hi > lo)
+        count = (hi - lo)[cells]
+
+        # one (cell, level) pair per crossing, with cells in raster order
+        first      = np.cumsum(count) - count
+        pair_cell  = np.repeat(cells,count)
+        pair_level = np.repeat(lo[cells],count) + np.arange(len(pair_cell)) - np.repeat(first,count)
+
+        # group by level; the stable sort keeps the raster order in a group
+        order = np.argsort(pair_level,kind='stable')
+
+        self._cells  = pair_cell[order]
+        self._bounds = np.searchsorted(pair_level[order],np.arange(len(self.levels)+1))
+
+        self._cache = dict()
+
+    def cells(self,level):
+        """flat indices (raster order) of the cells crossed by level"""
+
+        k = np.searchsorted(self.levels,level)
+
+        if (k < len(self.levels)) and (self.levels[k] == level):
+            return self._cells[self._bounds[k]:self._bounds[k+1]]
+
+        # not a level from the sweep: classify directly
+        ul,ur = self.Z[:-1,:-1],self.Z[:-1,1:]
+        ll,lr = self.Z[1:,:-1] ,self.Z[1:,1:]
+        cmin = np.minimum(np.minimum(ul,ur),np.minimum(ll,lr))
+        cmax = np.maximum(np.maximum(ul,ur),np.maximum(ll,lr))
+        return np.flatnonzero((cmin <= level) & (cmax > level))
+
+    def segments(self,level,cells=None):
+        """the marching-squares segments for level
+
+        inputs
+        ------------
+        level      : (float)    the contour level
+        cells      : (1d array, optional) flat cell indices to use, in raster
+                     order. defaults to every cell crossed by level.
+
+        returns
+        ------------
+        start      : (2d array) (K,2) row,column of the segment starts
+        end        : (2d array) (K,2) row,column of the segment ends
+        """
+
+        if cells is None:
+            cells = self.cells(level)
+
+        return contour_segments(self.Z,level,cells)
+
+    def find_contours(self,level):
+        """the contours at level, as skimage.measure.find_contours would give
+
+        returns
+        ------------
+        contours   : (list of 2d arrays) (K,2) row,column points of each contour
+        """
+
+        level = float(level)
+
+        if level not in self._cache:
+            start,end = self.segments(level)
+            self._cache[level] = _assemble_contours(start,end)
+
+        return self._cache[level]
+
+
+def find_contours_levels(Z,levels):
+    """find the contours of Z at every level, with a single sweep of the image
+
+    inputs
+    ------------
+    Z          : (2d array) surface density values
+    levels     : (1d array) the contour levels to find
+
+    returns
+    ------------
+    contours   : (list) for each level, the list of (K,2) contour arrays
+    """
+
+    sweep = ContourSweep(Z,levels)
+    return [sweep.find_contours(level) for level in levels]
+
+
+def contour_segments(Z,level,cells):
+    """the marching-squares segments for level in the given cells of Z
+
+    inputs
+    ------------
+    Z          : (2d array) surface density values
+    level      : (float)    the contour level
+    cells      : (1d array) flat cell indices (a cell is the square below and
+                 to the right of a pixel, numbered over Z.shape-1), in raster order
+
+    returns
+    ------------
+    start      : (2d array) (K,2) row,column of the segment starts
+    end        : (2d array) (K,2) row,column of the segment ends
+    """
+
+    ncol = Z.shape[1]
+    r0,c0 = np.divmod(cells,ncol-1)
+
+    ul = Z[r0,c0]
+    ur = Z[r0,c0+1]
+    ll = Z[r0+1,c0]
+    lr = Z[r0+1,c0+1]
+
+    case = (ul > level) + 2*(ur > level) + 4*(ll > level) + 8*(lr > level)
+
+    # interpolated crossing points on the four edges, as (n,4,2)
+    pts = np.empty((len(cells),4,2))
+    pts[:,0,0] = r0;                              pts[:,0,1] = c0 + _fraction(ul,ur,level)
+    pts[:,1,0] = r0 + 1;                          pts[:,1,1] = c0 + _fraction(ll,lr,level)
+    pts[:,2,0] = r0 + _fraction(ul,ll,level);     pts[:,2,1] = c0
+    pts[:,3,0] = r0 + _fraction(ur,lr,level);     pts[:,3,1] = c0 + 1
+
+    # one or two segments per cell, kept in cell order
+    efrom = _SEGMENT_FROM[case].ravel()
+    eto   = _SEGMENT_TO[case].ravel()
+    cell  = np.repeat(np.arange(len(cells)),2)
+
+    keep = efrom >= 0
+
+    return pts[cell[keep],efrom[keep]],pts[cell[keep],eto[keep]]
+
+
+def find_contours_cells(Z,level,cells):
+    """the contours at level, traced only through the given cells
+
+    where a contour lies entirely inside the cells, it is the same (point
+    for point) as from skimage.measure.find_contours on the full image.
+    the cells need not be sorted, or crossed by the level; cells with a
+    NaN corner are skipped.
+
+    inputs
+    ------------
+    Z          : (2d array) surface density values
+    level      : (float)    the contour level
+    cells      : (1d array) flat cell indices, numbered over Z.shape-1
+
+    returns
+    ------------
+    contours   : (list of 2d arrays) (K,2) row,column points of each contour
+    """
+
+    Z = np.asarray(Z,dtype=np.float64)
+    cells = _crossed_cells(Z,level,cells)
+
+    if len(cells) == 0:
+        return []
+
+    start,end = contour_segments(Z,float(level),cells)
+    return _assemble_contours(start,end)
+
+
+def first_contour_points(Z,level,cells):
+    """the points of find_contours_cells(Z,level,cells)[0], in no particular order
+
+    the conic fits do not depend on the order of the points, so the first
+    contour does not need to be assembled: it is the connected set of
+    segments holding the first segment (contours are numbered by their
+    first segment, and joins keep the lower number). the segments are
+    linked into chains through their shared end points, and each chain is
+    labelled by its smallest point with pointer jumping, in log2 of the
+    chain length array operations. a closed contour repeats the end of its
+    last segment, as the assembly does. where end points are shared by more
+    than two segments (levels that tie with pixel values), the contours are
+    assembled as usual.
+
+    inputs
+    ------------
+    Z          : (2d array) surface density values
+    level      : (float)    the contour level
+    cells      : (1d array) flat cell indices, numbered over Z.shape-1
+
+    returns
+    ------------
+    points     : (2d array) (K,2) row,column points of the first contour (K=0 if none)
+    """
+
+    Z = np.asarray(Z,dtype=np.float64)
+    cells = _crossed_cells(Z,level,cells)
+
+    start,end = contour_segments(Z,float(level),cells)
+
+    # segments that collapse to a point join nothing
+    keep = np.any(start != end,axis=1)
+    start,end = start[keep],end[keep]
+    nseg = len(start)
+
+    if nseg == 0:
+        return np.zeros((0,2))
+
+    # the points, identified exactly as the assembly matches them
+    keys,index = np.unique(np.concatenate([start[:,0] + 1j*start[:,1],end[:,0] + 1j*end[:,1]]),return_inverse=True)
+    source,target = index[:nseg],index[nseg:]
+    npoints = len(keys)
+
+    if (np.max(np.bincount(source,minlength=npoints)) > 1) or (np.max(np.bincount(target,minlength=npoints)) > 1):
+        return _assemble_contours(start,end)[0]
+
+    # the smallest point ahead of and behind each point along its chain
+    label = np.arange(npoints)
+    for link in [source,target]:
+        step = np.arange(npoints)
+        step[link] = target if link is source else source
+        smallest = np.arange(npoints)
+        for _ in range(int(np.ceil(np.log2(npoints))) + 1):
+            smallest = np.minimum(smallest,smallest[step])
+            step = step[step]
+        label = np.minimum(label,smallest)
+
+    member  = label == label[source[0]]
+    segment = np.flatnonzero(member[source])
+    points  = keys[member]
+
+    # a closed contour (as many segments as points) ends where its last segment does
+    if len(segment) == len(points):
+        points = np.append(points,keys[target[segment[-1]]])
+
+    return np.column_stack([points.real,points.imag])
+
+
+def _crossed_cells(Z,level,cells):
+    """the given cells that the level crosses, as ContourSweep would keep them (NaN crosses nothing), sorted and unique"""
+
+    cells = np.asarray(cells,dtype=np.intp)
+
+    ncol  = Z.shape[1]
+    first = cells + cells//(ncol-1)
+    Zflat = Z.ravel()
+    ul,ur = Zflat[first],Zflat[first+1]
+    ll,lr = Zflat[first+ncol],Zflat[first+ncol+1]
+
+    cmin = np.minimum(np.minimum(ul,ur),np.minimum(ll,lr))
+    cmax = np.maximum(np.maximum(ul,ur),np.maximum(ll,lr))
+
+    cells = np.sort(cells[(cmin <= level) & (cmax > level)])
+
+    if len(cells) == 0:
+        return cells
+
+    return cells[np.concatenate([[True],cells[1:] != cells[:-1]])]
+
+
+def _fraction(from_value,to_value,level):
+    """fractional distance of level between two corner values"""
+    with np.errstate(invalid='ignore',divide='ignore'):
+        return np.where(to_value == from_value,0.,(level - from_value)/(to_value - from_value))
+
+
+def _assemble_contours(start,end):
+    """join segments that share end points into contours
+
+    follows the ordering rules of skimage: contours are numbered by their
+    first segment, and when two are joined the lower number survives.
+    """
+
+    current_index = 0
+    contours = dict()
+    starts = dict()
+    ends = dict()
+
+    for from_point,to_point in zip(map(tuple,start.tolist()),map(tuple,end.tolist())):
+
+        if from_point == to_point:
+            continue
+
+        tail,tail_num = starts.pop(to_point,(None,None))
+        head,head_num = ends.pop(from_point,(None,None))
+
+        if (tail is not None) and (head is not None):
+            if tail is head:
+                head.append(to_point)
+            elif tail_num > head_num:
+                head.extend(tail)
+                contours.pop(tail_num,None)
+                starts[head[0]] = (head,head_num)
+                ends[head[-1]] = (head,head_num)
+            else:
+                tail.extendleft(reversed(head))
+                starts.pop(head[0],None)
+                contours.pop(head_num,None)
+                starts[tail[0]] = (tail,tail_num)
+                ends[tail[-1]] = (tail,tail_num)
+
+        elif (tail is None) and (head is None):
+            new_contour = deque((from_point,to_point))
+            contours[current_index] = new_contour
+            starts[from_point] = (new_contour,current_index)
+            ends[to_point] = (new_contour,current_index)
+            current_index += 1
+
+        elif head is None:
+            tail.appendleft(from_point)
+            starts[from_point] = (tail,tail_num)
+
+        else:
+            head.append(to_point)
+            ends[to_point] = (head,head_num)
+
+    return [np.array(contours[k]) for k in sorted(contours)]
@@ -8,6 +8,15 @@ https://ui.adsabs.harvard.edu/abs/2007MNRAS.381..943G/abstract
 see additional testing for verification in Zou et al. (2014)
 https://ui.adsabs.harvard.edu/abs/2014ApJ...791...11Z/abstract
 
+deproject :
+  vectorised deprojection of arrays of ellipses and viewing angles
+
+deproject_montecarlo :
+  propagate uncertain axes and viewing angles through the deprojection
+
+Deproject :
+  one ellipse at a time, as a class
+
 """
 
 import numpy as np
@@ -15,6 +24,209 @@ import numpy as np
 def st_from_xy(s,t,x,y,alpha):
     return x*np.cos(alpha) + y*np.sin(alpha),y*np.cos(alpha)-x*np.sin(alpha)
 
+
+def deproject(a,b,alpha,i):
+    """deproject ellipses, for broadcastable arrays of axes and viewing angles
+
+    evaluates equations A4-A12 of Gadotti et al. (2007), with the
+    trigonometric terms computed once for all inputs.
+
+    the semi-axes (A10, A11) are written with R = sqrt((A'-C')^2 + 4B'^2),
+    as 1/sqrt((A'+C' -/+ R)/2). this is the same quantity, but has no
+    singularity where A'=C' (i=0 and alpha=+/-n pi/4). the position angle
+    (A12) uses arctan2, so B'=0 (alpha=0, +/-n pi/2) is regular too. the
+    remaining singular case is the edge-on disc (i=pi/2), where the
+    deprojected ellipse is unbounded.
+
+    inputs
+    ------------
+    a          : (array) projected semi-major axis
+    b          : (array) projected semi-minor axis
+    alpha      : (array) angle between the projected major axis and the line of nodes, in radians
+    i          : (array) inclination, in radians
+
+    returns
+    ------------
+    D          : (dict of arrays)
+      sma      : deprojected semi-major axis
+      smb      : deprojected semi-minor axis
+      ecc      : deprojected ellipticity, 1-smb/sma
+      pa       : position angle of the deprojected major axis, from the line of nodes, in radians
+      singular : True where the deprojection is undefined (edge-on, or
+                 axes that are not positive and finite). sma, smb, ecc and
+                 pa are NaN there.
+    """
+
+    a,b,alpha,i = np.broadcast_arrays(*[np.asarray(v,dtype=float) for v in (a,b,alpha,i)])
+
+    cosa,sina = np.cos(alpha),np.sin(alpha)
+    cosi      = np.cos(i)
+
+    with np.errstate(divide='ignore',invalid='ignore',over='ignore'):
+
+        inva2,invb2 = 1./(a*a),1./(b*b)
+
+        # equations A4-A9, with D'=F'=0 and G'=-1
+        Aprime = cosa*cosa*inva2 + sina*sina*invb2
+        Bprime = cosa*sina*(inva2 - invb2)*cosi
+        Cprime = (sina*sina*inva2 + cosa*cosa*invb2)*cosi*cosi
+
+        # the eigenvalues of the conic: the larger directly, and the smaller
+        # from the determinant, A'C'-B'^2 = (cos i/ab)^2, to avoid cancellation
+        R    = np.hypot(Aprime - Cprime,2*Bprime)
+        lmax = 0.5*(Aprime + Cprime + R)
+        lmin = (cosi/(a*b))**2/lmax
+
+        singular = ~((a > 0.) & (b > 0.) & np.isfinite(lmax) & (lmin > 4*np.finfo(float).eps*lmax))
+
+        # equations A10-A11
+        sma = np.where(singular,np.nan,1./np.sqrt(lmin))
+        smb = np.where(singular,np.nan,1./np.sqrt(lmax))
+
+        # equation A12
+        pa  = np.where(singular,np.nan,Deproject._deprojected_position_angle(Aprime,Bprime,Cprime))
+
+    D = dict()
+    D['sma']      = sma[()]
+    D['smb']      = smb[()]
+    D['ecc']      = (1. - smb/sma)[()]
+    D['pa']       = pa[()]
+    D['singular'] = singular[()]
+
+    return D
+
+
+def deproject_montecarlo(a,b,alpha,i,nsamples=100000,chunksize=100000,bins=1000,smarange=None,percentiles=(2.5,16.,50.,84.,97.5),rng=None):
+    """Monte Carlo deprojection: the distribution of the deprojected bar length and ellipticity
+
+    each of a,b,alpha,i may be given as
+      -a number, held fixed
+      -a (mean,sigma) pair, drawn from a normal distribution
+      -a function f(rng,size) returning samples
+      -a distribution with an rvs(size,random_state) method (e.g. a frozen scipy.stats distribution)
+
+    the samples are drawn and deprojected chunksize at a time, and only
+    histograms and running sums are kept, so memory does not grow with
+    nsamples. singular samples (see deproject) are counted and left out of
+    the statistics.
+
+    inputs
+    ------------
+    a,b,alpha,i : the distributions of the projected axes and the viewing angles (radians), see above
+    nsamples    : (int) the number of samples
+    chunksize   : (int) the number of samples deprojected at once
+    bins        : (int) the number of histogram bins
+    smarange    : (2 floats, optional) the histogram range of sma. if None,
+                  0 to twice the 99.9th percentile of the first chunk.
+    percentiles : (1d array) the percentiles to report, from 0 to 100
+    rng         : (int or np.random.Generator, optional) random seed or generator
+
+    returns
+    ------------
+    MC          : (dict)
+      nsamples  : the number of samples drawn
+      nsingular : the number of singular samples, left out
+      sma,ecc   : (dict) for each quantity,
+        edges,counts : the histogram (counts outside the range are in underflow, overflow)
+        percentiles  : the requested percentiles, from the histogram. NaN if outside the range.
+                       they are interpolated linearly within a bin, so are only
+                       resolved to the bin width, (smarange[1]-smarange[0])/bins:
+                       a fixed input gives percentiles spread across one bin.
+        mean,std     : from the running sums
+    """
+
+    rng = np.random.default_rng(rng)
+
+    # the first chunk sets the sma range, if needed
+    size   = min(chunksize,nsamples)
+    sample = _deproject_chunk(a,b,alpha,i,rng,size)
+
+    if smarange is None:
+        good = sample['sma'][~sample['singular']]
+        smarange = (0.,2.*np.percentile(good,99.9)) if len(good) else (0.,1.)
+
+    ranges = {'sma':smarange,'ecc':(0.,1.)}
+
+    MC = dict()
+    MC['nsamples']  = 0
+    MC['nsingular'] = 0
+    for key in ranges.keys():
+        MC[key] = dict(edges=np.linspace(ranges[key][0],ranges[key][1],bins+1),counts=np.zeros(bins,dtype=int),
+                       underflow=0,overflow=0,sum=0.,sumsq=0.)
+
+    while True:
+
+        MC['nsamples']  += size
+        MC['nsingular'] += int(np.sum(sample['singular']))
+
+        for key in ranges.keys():
+            values = sample[key][~sample['singular']]
+            H      = MC[key]
+            H['counts']    += np.histogram(values,bins=H['edges'])[0]
+            H['underflow'] += int(np.sum(values < H['edges'][0]))
+            H['overflow']  += int(np.sum(values > H['edges'][-1]))
+            H['sum']       += np.sum(values)
+            H['sumsq']     += np.sum(values*values)
+
+        size = min(chunksize,nsamples - MC['nsamples'])
+        if size <= 0:
+            break
+
+        sample = _deproject_chunk(a,b,alpha,i,rng,size)
+
+    # summarise
+    nvalid = MC['nsamples'] - MC['nsingular']
+    for key in ranges.keys():
+        H = MC[key]
+
+        # the cumulative counts at the bin edges
+        cumulative = H['underflow'] + np.concatenate([[0],np.cumsum(H['counts'])])
+        target     = np.asarray(percentiles,dtype=float)/100.*nvalid
+
+        with np.errstate(invalid='ignore'):
+            inrange = (target >= cumulative[0]) & (target <= cumulative[-1]) & (nvalid > 0)
+        H['percentiles'] = np.where(inrange,np.interp(target,cumulative,H['edges']),np.nan)
+
+        with np.errstate(invalid='ignore',divide='ignore'):
+            H['mean'] = H['sum']/nvalid
+            H['std']  = np.sqrt(np.maximum(H['sumsq']/nvalid - H['mean']**2,0.))
+
+        del H['sum'],H['sumsq']
+
+    return MC
+
+
+def _deproject_chunk(a,b,alpha,i,rng,size):
+    """draw size samples of the inputs and deproject them"""
+
+    D = deproject(*[_draw(dist,rng,size) for dist in (a,b,alpha,i)])
+
+    # anything else that is not finite is treated as singular too
+    D['singular'] = D['singular'] | ~np.isfinite(D['sma']) | ~np.isfinite(D['ecc'])
+
+    return D
+
+
+def _draw(dist,rng,size):
+    """size samples from one of the distributions accepted by deproject_montecarlo"""
+
+    if hasattr(dist,'rvs'):
+        return np.asarray(dist.rvs(size=size,random_state=rng),dtype=float)
+
+    if callable(dist):
+        return np.asarray(dist(rng,size),dtype=float)
+
+    dist = np.asarray(dist,dtype=float)
+
+    if dist.ndim == 0:
+        return np.full(size,float(dist))
+
+    if dist.shape == (2,):
+        return rng.normal(dist[0],dist[1],size)
+
+    raise ValueError('elliptical.deproject.deproject_montecarlo: distributions must be a number, a (mean,sigma) pair, a function or have an rvs method.')
+
+
 class Deproject(object):
 
     def __init__(self,a,b,alpha,i):
@@ -30,6 +242,8 @@ class Deproject(object):
 
         **Note that equations for s1 and s2 have singularities when i = 0 and α = ±nπ/4 (n being a positive integer). A singularity also appears in equation the position angle of the deprojected ellipse when α = 0, ±nπ/2. If i = π/2, the above three equations diverge.
 
+        The equations are evaluated by deproject, which also accepts arrays; see there for the singular cases.
+
         """
 
         self.a     = a
@@ -37,21 +251,15 @@ class Deproject(object):
         self.alpha = alpha
         self.i     = i
 
-        A = self._Aprime()
-        B = self._Bprime()
-        C = self._Cprime()
-        D = self._Dprime()
-        F = self._Fprime()
-        G = self._Gprime()
-
-        s1 = Deproject._s1(A,B,C,D,F,G)
-        s2 = Deproject._s2(A,B,C,D,F,G)
+        D = deproject(a,b,alpha,i)
 
-        self.sma = np.nanmax([s1,s2])
-        self.smb = np.nanmin([s1,s2])
-        self.ecc = 1. - (self.smb/self.sma)
+        self.sma = D['sma']
+        self.smb = D['smb']
+        self.ecc = D['ecc']
 
-        # the ellipse comes out by defininition with phi=0, xcentre=ycentre=0
+        # the deprojected ellipse is centred, with position angle pa from the line of nodes
+        self.pa       = D['pa']
+        self.singular = D['singular']
 
     def _A(self):
         """equation A4"""
@@ -132,5 +340,8 @@ class Deproject(object):
 
     @staticmethod
     def _deprojected_position_angle(Aprime,Bprime,Cprime):
-        """equation A12"""
-        return -0.5 * (np.arctan((Cprime-Aprime)/(2*Bprime))**(-1))
+        """equation A12
+
+        tan(2 pa) = 2B'/(A'-C'), taking the branch of the major axis
+        """
+        return 0.5*np.arctan2(-2*Bprime,Cprime-Aprime)
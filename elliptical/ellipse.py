@@ -8,11 +8,18 @@ SOEllipse :
 Ellipse :
   generalise ellipse properties
 
+ellipse_mask :
+  the pixels of an image inside an ellipse, visiting only its bounding box
+
+ellipse_labels :
+  which annulus of a nested family of ellipses each pixel falls in
+
 
 """
 
 import numpy as np
 
+from .table import EllipseTable
 
 class SOEllipse(object):
     '''Conic Ellipse fitter
@@ -28,13 +35,35 @@ class SOEllipse(object):
     1. This does, in fact, follow the notation of the wikipedia page
     'Matrix representation of conic sections'
 
+    2. Two solvers are available for the scatter matrix:
+    'eig'    : the original Fitzgibbon et al. (1999) 6x6 eigenproblem
+    'direct' : the Halir & Flusser (1998) partitioned 3x3 reduction, on
+               centred and scaled points, keeping the root with 4ac-b^2>0:
+               the result is always an ellipse, or NaN if there is none
+    'eig' is the fast path and the default. 'direct' buys the guarantee
+    with more small array operations: about 3x the time of 'eig' for a
+    single fitEllipse (170 against 50 microseconds on a 300 point contour),
+    and from about the same to 20% more in the batched fitEllipses.
+
     '''
     @staticmethod
-    def fitEllipse(x,y):
+    def fitEllipse(x,y,solver='eig'):
         """take a set of x,y points at fit an ellipse to it
 
+        solver : (string) 'eig' or 'direct', see the class notes
+
         """
 
+        if solver == 'direct':
+            # centre the points and scale them to unit rms radius
+            x,y = np.asarray(x,dtype=float),np.asarray(y,dtype=float)
+            xcentre,ycentre = np.mean(x),np.mean(y)
+            x,y = x - xcentre,y - ycentre
+            scale = np.sqrt(np.mean(x*x + y*y))
+            if not scale > 0:
+                scale = 1.
+            x,y = x/scale,y/scale
+
         # recast in a favourable form
         x = x[:,np.newaxis]
         y = y[:,np.newaxis]
@@ -42,6 +71,11 @@ class SOEllipse(object):
 
         D =  np.hstack((x*x, x*y, y*y, x, y, np.ones_like(x)))
         S = np.dot(D.T,D)
+
+        if solver == 'direct':
+            a = SOEllipse._solve_direct(S[np.newaxis])
+            return SOEllipse._unnormalise(a,np.array([xcentre]),np.array([ycentre]),np.array([scale]))[0]
+
         C = np.zeros([6,6])
         C[0,2] = C[2,0] = 2; C[1,1] = -1
 
@@ -54,9 +88,224 @@ class SOEllipse(object):
         # return the factors to construct the ellipse
         return a
 
+    @staticmethod
+    def fitEllipses(x,y,offsets=None,solver='eig'):
+        """take many sets of x,y points and fit an ellipse to each, in one pass
+
+        inputs
+        ------------
+        x          : (list of 1d arrays, or 1d array) x values of the contours
+        y          : (list of 1d arrays, or 1d array) y values of the contours
+        offsets    : (1d array, optional) if given, x and y are all contours
+                     concatenated end to end, and offsets holds the starting
+                     index of each contour
+        solver     : (string) 'eig' or 'direct', see the class notes
+
+        returns
+        ------------
+        a          : (2d array) (N,6) conic coefficients, one row per contour.
+                     Rows that could not be fit are NaN.
+
+        notes
+        --------
+        1. every entry of S = D^T D is a sum of some x^p y^q with p+q<=4, so
+        the 15 distinct monomials are summed per contour with one reduceat and
+        scattered into the (N,6,6) stack of scatter matrices.
+
+        """
+
+        if offsets is None:
+            npts    = np.array([len(xx) for xx in x],dtype=int)
+            x       = np.concatenate([np.ravel(xx) for xx in x] + [np.zeros(0)]).astype(float)
+            y       = np.concatenate([np.ravel(yy) for yy in y] + [np.zeros(0)]).astype(float)
+            offsets = np.cumsum(npts) - npts
+        else:
+            x       = np.asarray(x,dtype=float)
+            y       = np.asarray(y,dtype=float)
+            offsets = np.asarray(offsets,dtype=int)
+            npts    = np.diff(np.append(offsets,len(x)))
+
+        a = np.full((len(offsets),6),np.nan)
+
+        # a conic needs at least five points; insist on six for a unique fit
+        good = npts >= 6
+
+        if not np.any(good):
+            return a
+
+        # the direct solver works on centred points scaled to unit rms radius
+        if solver == 'direct':
+            with np.errstate(invalid='ignore',divide='ignore'):
+                count   = np.maximum(npts,1)
+                xcentre = np.add.reduceat(np.append(x,0.),offsets)/count
+                ycentre = np.add.reduceat(np.append(y,0.),offsets)/count
+                x       = x - np.repeat(xcentre,npts)
+                y       = y - np.repeat(ycentre,npts)
+                scale   = np.sqrt(np.add.reduceat(np.append(x*x + y*y,0.),offsets)/count)
+                scale   = np.where((npts > 0) & (scale > 0),scale,1.)
+                x       = x/np.repeat(scale,npts)
+                y       = y/np.repeat(scale,npts)
+
+        # exponents of x and y in each column of the design matrix
+        xexp = np.array([2,1,0,1,0,0])
+        yexp = np.array([0,1,2,0,1,0])
+        moment = 5*(xexp[:,np.newaxis]+xexp) + (yexp[:,np.newaxis]+yexp)
+        umoment,inverse = np.unique(moment,return_inverse=True)
+
+        # build each monomial from a lower one with a single multiply.
+        # the zero column on the end keeps reduceat in bounds for empty
+        # contours, which are masked anyway
+        monomials = np.zeros((len(umoment),len(x)+1))
+        monomials[0,:-1] = 1.
+        row = dict(zip(umoment,range(len(umoment))))
+        for k,m in enumerate(umoment[1:],1):
+            if m%5:
+                np.multiply(monomials[row[m-1],:-1],y,out=monomials[k,:-1])
+            else:
+                np.multiply(monomials[row[m-5],:-1],x,out=monomials[k,:-1])
+
+        # sum the monomials per contour
+        sums = np.add.reduceat(monomials,offsets,axis=1).T
+
+        S = sums[:,inverse.ravel()].reshape(-1,6,6)
+
+        if solver == 'direct':
+            a[good] = SOEllipse._unnormalise(SOEllipse._solve_direct(S[good]),xcentre[good],ycentre[good],scale[good])
+        else:
+            a[good] = SOEllipse._solve_scatter(S[good])
+
+        return a
+
+    @staticmethod
+    def _solve_scatter(S):
+        """solve a stack of (N,6,6) scatter matrices for the conic coefficients
+
+        singular matrices, or fits that only have complex eigenvectors, are
+        returned as NaN rows rather than raising.
+
+        """
+
+        C = np.zeros([6,6])
+        C[0,2] = C[2,0] = 2; C[1,1] = -1
+
+        try:
+            Sinv = np.linalg.inv(S)
+        except np.linalg.LinAlgError:
+            # at least one singular matrix in the stack: invert the others
+            Sinv = np.full(S.shape,np.nan)
+            for k in range(len(S)):
+                try:
+                    Sinv[k] = np.linalg.inv(S[k])
+                except np.linalg.LinAlgError:
+                    pass
+
+        finite = np.all(np.isfinite(Sinv),axis=(1,2))
+        a = np.full((len(S),6),np.nan)
+
+        if not np.any(finite):
+            return a
+
+        E, V = np.linalg.eig(Sinv[finite] @ C)
+
+        n = np.argmax(np.abs(E),axis=1)
+        vec = V[np.arange(len(n)),:,n]
+
+        # eig goes complex for the whole stack if any one matrix does
+        if np.iscomplexobj(vec):
+            vec[np.any(vec.imag != 0,axis=1)] = np.nan
+            vec = vec.real
+
+        a[finite] = vec
+
+        return a
+
+    @staticmethod
+    def _solve_direct(S):
+        """solve a stack of (N,6,6) scatter matrices with the reduced 3x3 method
+
+        following Halir & Flusser (1998), partition S into quadratic and
+        linear blocks, eliminate the linear coefficients, and solve
+
+            C1^-1 M a1 = (1/mu) a1,   M = S1 - S2 S3^-1 S2^T
+
+        of the three eigenvectors, the ellipse is the one with
+        a1^T C1 a1 = 4ac-b^2 > 0. M may be singular (points exactly on an
+        ellipse make it so), which is why this is solved as an ordinary
+        eigenproblem rather than through a factorisation of M.
+
+        degenerate contours (e.g. collinear points), and fits with no
+        ellipse root, are returned as NaN rows.
+
+        """
+
+        try:
+            return SOEllipse._direct_stack(S)
+
+        except np.linalg.LinAlgError:
+            # at least one degenerate matrix in the stack: go one at a time
+            a = np.full((len(S),6),np.nan)
+            for k in range(len(S)):
+                try:
+                    a[k] = SOEllipse._direct_stack(S[k:k+1])[0]
+                except np.linalg.LinAlgError:
+                    pass
+            return a
+
+    @staticmethod
+    def _direct_stack(S):
+        """the reduced 3x3 solve for a stack of matrices with invertible S3"""
+
+        C1inv = np.array([[0.,0.,0.5],[0.,-1.,0.],[0.5,0.,0.]])
+
+        S1 = S[:,:3,:3]
+        S2 = S[:,:3,3:]
+        S3 = S[:,3:,3:]
+
+        # the linear coefficients follow from the quadratic ones: a2 = T a1
+        T = -np.linalg.solve(S3,np.swapaxes(S2,1,2))
+        M = S1 + S2 @ T
+
+        w, v = np.linalg.eig(C1inv @ M)
+
+        # the ellipse root: real, with 4ac-b^2 > 0 (eigenvectors are unit length)
+        vr = v.real
+        constraint = 4*vr[:,0,:]*vr[:,2,:] - vr[:,1,:]**2
+        constraint = np.where((w.imag == 0) & np.all(np.isfinite(vr),axis=1),constraint,-np.inf)
+
+        n  = np.argmax(constraint,axis=1)
+        a1 = vr[np.arange(len(n)),:,n][:,:,np.newaxis]
+        a2 = T @ a1
+
+        a = np.concatenate((a1,a2),axis=1)[:,:,0]
+        a[constraint[np.arange(len(n)),n] <= 0] = np.nan
+
+        return a
+
+    @staticmethod
+    def _unnormalise(a,xcentre,ycentre,scale):
+        """conic coefficients for points (x-xcentre)/scale, back in terms of x,y"""
+
+        A,B,C,D,E,F = a.T
+        out = np.empty_like(a)
+        out[:,0] = A
+        out[:,1] = B
+        out[:,2] = C
+        out[:,3] = D*scale - 2*A*xcentre - B*ycentre
+        out[:,4] = E*scale - B*xcentre - 2*C*ycentre
+        out[:,5] = (A*xcentre*xcentre + B*xcentre*ycentre + C*ycentre*ycentre
+                    - D*scale*xcentre - E*scale*ycentre + F*scale*scale)
+
+        # the coefficients of the original, unscaled points are tiny or huge
+        # when the scale is far from 1: normalise them
+        norm = np.sqrt(np.sum(out*out,axis=1))[:,np.newaxis]
+        with np.errstate(invalid='ignore',divide='ignore'):
+            return out/norm
+
     @staticmethod
     def ellipse_center(a):
-        b,c,d,f,g,a = a[1]/2, a[2], a[3]/2, a[4]/2, a[5], a[0]
+        """centre of the ellipse from one (6,) or a stack of (N,6) coefficients"""
+        a = np.asarray(a)
+        b,c,d,f,g,a = a[...,1]/2, a[...,2], a[...,3]/2, a[...,4]/2, a[...,5], a[...,0]
         num = b*b-a*c
         x0=(c*d-b*f)/num
         y0=(a*f-b*d)/num
@@ -65,13 +314,21 @@ class SOEllipse(object):
 
     @staticmethod
     def ellipse_angle_of_rotation( a ):
-        b,c,d,f,g,a = a[1]/2, a[2], a[3]/2, a[4]/2, a[5], a[0]
+        """rotation angle from one (6,) or a stack of (N,6) coefficients"""
+        a = np.asarray(a)
+        b,c,d,f,g,a = a[...,1]/2, a[...,2], a[...,3]/2, a[...,4]/2, a[...,5], a[...,0]
 
         return 0.5*np.arctan(2*b/(a-c))
 
     @staticmethod
     def ellipse_axis_length( a ):
-        b,c,d,f,g,a = a[1]/2, a[2], a[3]/2, a[4]/2, a[5], a[0]
+        """axis lengths from one (6,) or a stack of (N,6) coefficients
+
+        returns a (2,) or (2,N) array; which of the two is the semi-major
+        axis is left to the caller.
+        """
+        a = np.asarray(a)
+        b,c,d,f,g,a = a[...,1]/2, a[...,2], a[...,3]/2, a[...,4]/2, a[...,5], a[...,0]
         up = 2*(a*f*f+c*d*d+g*b*b-2*b*d*f-a*c*g)
         down1=(b*b-a*c)*( (c-a)*np.sqrt(1+4*b*b/((a-c)*(a-c)))-(c+a))
         down2=(b*b-a*c)*( (a-c)*np.sqrt(1+4*b*b/((a-c)*(a-c)))-(c+a))
@@ -89,31 +346,13 @@ class SOEllipse(object):
         determine whether a set of points is inside of an ellipse
 
         '''
-        # transform all points to ellipse coordinate centre
-        cellipse = ellipse_center(a)
-        xpts -= cellipse[0]
-        ypts -= cellipse[1]
-
-        # rotate points to align with ellipse
-        rpts = np.sqrt(xpts**2 + ypts**2)
-        thpts = np.arctan2(ypts,xpts)
-
-        phi = ellipse_angle_of_rotation( a )
+        cellipse = SOEllipse.ellipse_center(a)
+        phi      = SOEllipse.ellipse_angle_of_rotation(a)
 
-        # de-rotate points according to phi
-        # assumes phi is a counterclockwise rotation, so undo with clockwise
-        xell = xpts*np.cos(phi) + ypts*np.sin(phi)
-        yell =-xpts*np.sin(phi) + ypts*np.cos(phi)
+        # the first axis length is the one along phi
+        sma,smb  = SOEllipse.ellipse_axis_length(a)
 
-        sma,ecc = ellipse_axis_length( a )
-        smb = sma * (1-ecc)
-
-        ellipse_radius = (xell/sma)**2 + (yell/smb)**2
-
-        yes_ellipse = np.where(ellipse_radius < 1.)[0]
-        ellipse_array = np.zeros(len(xpts))
-        ellipse_array[yes_ellipse] = 1
-        return ellipse_array
+        return inside_ellipse(sma,smb,phi,cellipse[0],cellipse[1],xpts,ypts)
 
 
 class Ellipse():
@@ -177,11 +416,14 @@ def inside_ellipse( sma,smb,phi,xcentre,ycentre, xpts, ypts ):
 
     determine whether a set of points is inside of an ellipse
 
+    xpts and ypts are not changed. for images, ellipse_mask only visits the
+    pixels near the ellipse.
+
     '''
     # transform all points to ellipse coordinate centre
     #cellipse = ellipse_center(a)
-    xpts -= xcentre
-    ypts -= ycentre
+    xpts = np.asarray(xpts) - xcentre
+    ypts = np.asarray(ypts) - ycentre
 
     # de-rotate points according to phi
     # assumes phi is a counterclockwise rotation, so undo with clockwise
@@ -197,3 +439,173 @@ def inside_ellipse( sma,smb,phi,xcentre,ycentre, xpts, ypts ):
     ellipse_array[yes_ellipse] = 1
 
     return ellipse_array
+
+
+def ellipse_bounds(sma,smb,phi,C=2.):
+    """half-widths of the box around an ellipse, along the axis phi is measured from and across it
+
+    for C > 2 (boxy) the shape is bounded by its rotated a x b rectangle;
+    otherwise by the C=2 ellipse.
+    """
+
+    cosphi,sinphi = np.abs(np.cos(phi)),np.abs(np.sin(phi))
+
+    if C > 2.:
+        return sma*cosphi + smb*sinphi,sma*sinphi + smb*cosphi
+
+    return np.sqrt((sma*cosphi)**2 + (smb*sinphi)**2),np.sqrt((sma*sinphi)**2 + (smb*cosphi)**2)
+
+
+def ellipse_mask(sma,smb,phi,xcentre,ycentre,grid,C=2.,flat=False):
+    '''the pixels of an image inside an ellipse
+
+    only the pixels in the ellipse's bounding box are evaluated, so the
+    cost follows the ellipse area rather than the image size, and the
+    image coordinates are never copied or changed.
+
+    the ellipse is taken as map_ellipses gives it: xcentre is the column
+    coordinate of the centre and ycentre the row coordinate (x and y of an
+    'xy' meshgrid image), and phi is measured from the row axis towards the
+    column axis, the frame in which the conics are fitted.
+
+    inputs
+    ------------
+    sma,smb          : (float) semi-major and semi-minor axes
+    phi              : (float) ellipse angle, from the row axis towards the column axis
+    xcentre,ycentre  : (float) the column and row coordinates of the centre ('xc' and 'yc')
+    grid             : (ImageGrid) the image geometry
+    C                : (float) generalised ellipse exponent, |x/a|^C + |y/b|^C < 1
+                       (C=2 an ellipse, C>2 boxy), as Ellipse.inside_ellipse
+    flat             : (bool) if True, return the flat (raster) indices of
+                       the pixels inside, instead of the mask
+
+    returns
+    ------------
+    mask             : (2d bool array) grid.shape, True inside the ellipse
+      or
+    indices          : (1d int array) flat indices of the pixels inside
+    '''
+
+    lo,hi = _bounding_box(sma,smb,phi,xcentre,ycentre,grid,C=C)
+
+    # the ellipse coordinates of the pixels in the box only
+    rowpts = grid.rowaxis[lo[0]:hi[0],np.newaxis] - ycentre
+    colpts = grid.colaxis[np.newaxis,lo[1]:hi[1]] - xcentre
+
+    xell = rowpts*np.cos(phi) + colpts*np.sin(phi)
+    yell =-rowpts*np.sin(phi) + colpts*np.cos(phi)
+
+    inside = (np.abs(xell/sma)**C + np.abs(yell/smb)**C) < 1.
+
+    if flat:
+        rows,cols = np.nonzero(inside)
+        return (rows + lo[0])*grid.shape[1] + (cols + lo[1])
+
+    mask = np.zeros(grid.shape,dtype=bool)
+    mask[lo[0]:hi[0],lo[1]:hi[1]] = inside
+    return mask
+
+
+def ellipse_labels(M,grid,C=2.):
+    '''label every pixel by the smallest ellipse of a nested family that contains it
+
+    the ellipses are ordered by semi-major axis, and each pixel's place in
+    that order is found by a binary search, testing one ellipse per pixel
+    per step: log2(N) mask evaluations for N ellipses, over the bounding box
+    of the largest ellipse only.
+
+    the ellipses are assumed nested (as traced isophotes are); where two
+    cross, pixels in the crossing region take one of the two labels.
+
+    inputs
+    ------------
+    M          : (dict or EllipseTable) the ellipses, as returned by map_ellipses
+                 (centres and angles as in ellipse_mask)
+    grid       : (ImageGrid) the image geometry (see ellipse_mask)
+    C          : (float) generalised ellipse exponent (see ellipse_mask)
+
+    returns
+    ------------
+    labels     : (2d int array) grid.shape, the key in M of the smallest
+                 ellipse containing each pixel, -1 outside all of them.
+                 pixels with the same label lie in the annulus between that
+                 ellipse and the next smaller one.
+    '''
+
+    keys,sma,smb,phi,xcentre,ycentre = _ellipse_columns(M)
+
+    labels = np.full(grid.shape,-1,dtype=int)
+    if len(sma) == 0:
+        return labels
+
+    # smallest first
+    order = np.argsort(sma,kind='stable')
+    nell  = len(order)
+
+    cosphi,sinphi = np.cos(phi[order]),np.sin(phi[order])
+    sma,smb       = sma[order],smb[order]
+    xcentre       = xcentre[order]
+    ycentre       = ycentre[order]
+
+    # only pixels in the ellipses' boxes can be labelled
+    lo,hi = _bounding_box(sma,smb,phi[order],xcentre,ycentre,grid,C=C)
+
+    rowpts = np.broadcast_to(grid.rowaxis[lo[0]:hi[0],np.newaxis],(hi[0]-lo[0],hi[1]-lo[1])).ravel()
+    colpts = np.broadcast_to(grid.colaxis[np.newaxis,lo[1]:hi[1]],(hi[0]-lo[0],hi[1]-lo[1])).ravel()
+
+    # the first ellipse containing each pixel lies in [first,last]; nell is none
+    first = np.zeros(len(rowpts),dtype=int)
+    last  = np.full(len(rowpts),nell)
+
+    active = np.flatnonzero(first < last)
+    while len(active):
+
+        mid = (first[active] + last[active])//2
+
+        drow = rowpts[active] - ycentre[mid]
+        dcol = colpts[active] - xcentre[mid]
+        xell = drow*cosphi[mid] + dcol*sinphi[mid]
+        yell =-drow*sinphi[mid] + dcol*cosphi[mid]
+
+        inside = (np.abs(xell/sma[mid])**C + np.abs(yell/smb[mid])**C) < 1.
+
+        last[active]  = np.where(inside,mid,last[active])
+        first[active] = np.where(inside,first[active],mid+1)
+
+        active = active[first[active] < last[active]]
+
+    keys = np.append(np.asarray(keys)[order],-1)
+    labels[lo[0]:hi[0],lo[1]:hi[1]] = keys[first].reshape(hi[0]-lo[0],hi[1]-lo[1])
+
+    return labels
+
+
+def _bounding_box(sma,smb,phi,xcentre,ycentre,grid,C=2.):
+    """the (row,column) index ranges [lo,hi) of the pixels that can be inside an ellipse (or any of several)
+
+    xcentre and ycentre are the column and row coordinates of the centres, as in ellipse_mask.
+    """
+
+    drow,dcol = ellipse_bounds(sma,smb,phi,C=C)
+    xcentre   = np.atleast_1d(xcentre)
+    ycentre   = np.atleast_1d(ycentre)
+
+    corners = grid.coords_to_index(np.concatenate([np.column_stack([ycentre-drow,xcentre-dcol]),
+                                                   np.column_stack([ycentre+drow,xcentre+dcol])]))
+
+    lo = np.clip(np.floor(np.min(corners,axis=0)).astype(int),0,grid.shape)
+    hi = np.clip(np.ceil(np.max(corners,axis=0)).astype(int)+1,0,grid.shape)
+
+    return lo,hi
+
+
+def _ellipse_columns(M):
+    """the keys and a,b,p,xc,yc columns of a map_ellipses result"""
+
+    if isinstance(M,EllipseTable):
+        return np.arange(len(M)),M.a,M.b,M.p,M.xc,M.yc
+
+    keys = list(M.keys())
+    columns = [np.array([M[k][field] for k in keys],dtype=float) for field in ['a','b','p','xc','yc']]
+
+    return (keys,*columns)
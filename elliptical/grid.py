@@ -0,0 +1,149 @@
+"""grid
+
+image geometry, computed once and shared between calls
+
+ImageGrid :
+  the physical coordinates along the rows and columns of an image,
+  and the mapping between (fractional) pixel indices and coordinates
+
+
+"""
+
+import numpy as np
+
+
+class ImageGrid(object):
+    '''geometry of an image: origin, spacing and shape
+
+    rows and columns are the array axes (0 and 1) of the image. For images
+    made with np.meshgrid(x,y) (the default 'xy' indexing, as in the bundled
+    test images), the row axis holds y and the column axis holds x.
+
+    uniform axes map indices to coordinates with origin + spacing*index;
+    non-uniform axes are linearly interpolated.
+
+    '''
+
+    def __init__(self,rowaxis,colaxis,uniform=None):
+        """
+        inputs
+        ------------
+        rowaxis    : (1d array) coordinate of each row
+        colaxis    : (1d array) coordinate of each column
+        uniform    : (bool)     treat the axes as evenly spaced. if None,
+                                decide from the axes (see is_uniform)
+
+        """
+
+        self.rowaxis = np.asarray(rowaxis,dtype=float)
+        self.colaxis = np.asarray(colaxis,dtype=float)
+
+        self.shape   = (len(self.rowaxis),len(self.colaxis))
+        self.origin  = np.array([self.rowaxis[0],self.colaxis[0]])
+
+        # as before: the spacing is taken from the first two samples
+        self.spacing = np.array([ImageGrid._first_step(self.rowaxis),ImageGrid._first_step(self.colaxis)])
+
+        if uniform is None:
+            uniform = ImageGrid.is_uniform(self.rowaxis) and ImageGrid.is_uniform(self.colaxis)
+
+        self.uniform = uniform
+
+    @classmethod
+    def from_xy(cls,X,Y,uniform=None):
+        """build the grid from the X,Y coordinate arrays of an image
+
+        X and Y may be 2d arrays, in either 'xy' or 'ij' meshgrid
+        indexing, or the 1d x and y axes of an 'xy' image.
+
+        """
+
+        X = np.asarray(X)
+        Y = np.asarray(Y)
+
+        if X.ndim == 1:
+            return cls(Y,X,uniform=uniform)
+
+        # does X change along the columns ('xy') or the rows ('ij')?
+        if (X.shape[1] > 1) and (X[0,1] != X[0,0]):
+            return cls(Y[:,0],X[0,:],uniform=uniform)
+        else:
+            return cls(X[:,0],Y[0,:],uniform=uniform)
+
+    @classmethod
+    def from_origin(cls,origin,spacing,shape):
+        """build a uniform grid from (row,column) origin, spacing and shape"""
+
+        rowaxis = origin[0] + spacing[0]*np.arange(shape[0])
+        colaxis = origin[1] + spacing[1]*np.arange(shape[1])
+        return cls(rowaxis,colaxis,uniform=True)
+
+    @staticmethod
+    def is_uniform(axis,tol=0.1):
+        """are the coordinates along axis evenly spaced, to within tol of a step?
+
+        each coordinate is compared with evenly spaced ones from the first
+        to the last, so a small drift in the step, which adds up along the
+        axis, is caught (a step ramping from 1.0 to 1.04 over 256 pixels is
+        not uniform). coordinates written out with a few decimal places (as
+        in the bundled .dat files, about 0.01 of a step off) still count.
+        """
+
+        if len(axis) < 3:
+            return True
+
+        step = (axis[-1] - axis[0])/(len(axis) - 1)
+        even = np.linspace(axis[0],axis[-1],len(axis))
+        return bool((step != 0.) and np.all(np.abs(axis - even) < tol*np.abs(step)))
+
+    @staticmethod
+    def _first_step(axis):
+        if len(axis) < 2:
+            return 1.
+        return axis[1] - axis[0]
+
+    def index_to_coords(self,index):
+        """map (K,2) fractional (row,column) indices to (K,2) coordinates
+
+        returns
+        ------------
+        coords     : (2d array) (K,2) row and column coordinates of each point
+        """
+
+        index = np.asarray(index,dtype=float).reshape(-1,2)
+
+        if self.uniform:
+            return self.origin + self.spacing*index
+
+        coords = np.empty_like(index)
+        coords[:,0] = np.interp(index[:,0],np.arange(self.shape[0]),self.rowaxis)
+        coords[:,1] = np.interp(index[:,1],np.arange(self.shape[1]),self.colaxis)
+        return coords
+
+    def coords_to_index(self,coords):
+        """map (K,2) row and column coordinates to (K,2) fractional (row,column) indices
+
+        the inverse of index_to_coords. coordinates off a non-uniform grid
+        are clamped to its edges.
+
+        returns
+        ------------
+        index      : (2d array) (K,2) fractional row and column indices of each point
+        """
+
+        coords = np.asarray(coords,dtype=float).reshape(-1,2)
+
+        if self.uniform:
+            return (coords - self.origin)/self.spacing
+
+        index = np.empty_like(coords)
+        for dim,axis in enumerate([self.rowaxis,self.colaxis]):
+            if axis[-1] < axis[0]:
+                index[:,dim] = np.interp(coords[:,dim],axis[::-1],np.arange(len(axis))[::-1])
+            else:
+                index[:,dim] = np.interp(coords[:,dim],axis,np.arange(len(axis)))
+        return index
+
+    def meshgrid(self):
+        """the 2d X,Y coordinate arrays ('xy' indexing) of the grid"""
+        return np.meshgrid(self.colaxis,self.rowaxis)
@@ -0,0 +1,227 @@
+"""imagefile
+
+binary image files: the grid geometry in a short header, and Z stored
+raw and contiguous, so that it can be memory-mapped with no parsing or copy
+
+save_image :
+  write Z and its ImageGrid
+
+load_image :
+  open a saved image, memory-mapped by default
+
+read_dat :
+  parse the text layout of the bundled test images (a 'xdim ydim' line,
+  then x y z columns)
+
+load_dat :
+  read_dat through a binary cache, rebuilt whenever the text file changes
+
+cache_directory :
+  where load_dat keeps its caches
+
+
+the file layout is
+  8 bytes  : magic, b'ELLIPIMG'
+  8 bytes  : header length in bytes, little-endian unsigned
+  header   : JSON (shape, dtype, row and column axes, source file stamp),
+             padded with spaces so that the data starts on a 64-byte boundary
+  data     : Z, C order
+
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+
+import numpy as np
+
+from .grid import ImageGrid
+
+
+_MAGIC     = b'ELLIPIMG'
+_ALIGNMENT = 64
+_VERSION   = 1
+
+
+def save_image(filename,Z,grid,source=None):
+    """write an image and its geometry to a binary image file
+
+    the file is written to a temporary name and renamed into place, so a
+    reader never sees a partial file.
+
+    inputs
+    ------------
+    filename   : (str) the output file
+    Z          : (2d array) the image
+    grid       : (ImageGrid) the image geometry
+    source     : (dict, optional) stamp of the file the image came from (see load_dat)
+
+    """
+
+    Z = np.ascontiguousarray(Z)
+
+    if Z.ndim != 2 or tuple(Z.shape) != tuple(grid.shape):
+        raise ValueError('elliptical.imagefile.save_image: Z must be 2d, with the shape of the grid.')
+
+    header = dict()
+    header['version'] = _VERSION
+    header['shape']   = list(Z.shape)
+    header['dtype']   = Z.dtype.newbyteorder('<').str
+    header['uniform'] = bool(grid.uniform)
+    header['rowaxis'] = grid.rowaxis.tolist()
+    header['colaxis'] = grid.colaxis.tolist()
+    header['source']  = source
+
+    text = json.dumps(header).encode('utf-8')
+
+    # pad the header so the data is aligned for memory-mapping
+    used = len(_MAGIC) + 8 + len(text)
+    text = text + b' '*(-used % _ALIGNMENT)
+
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd,tmpname = tempfile.mkstemp(dir=directory,suffix='.tmp')
+    try:
+        with os.fdopen(fd,'wb') as f:
+            f.write(_MAGIC)
+            f.write(np.array(len(text),dtype='<u8').tobytes())
+            f.write(text)
+            f.write(Z.astype(header['dtype'],copy=False).tobytes())
+        os.replace(tmpname,filename)
+    except BaseException:
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+        raise
+
+
+def load_image(filename,mmap=True):
+    """open a binary image file
+
+    inputs
+    ------------
+    filename   : (str) the file, as written by save_image
+    mmap       : (bool) memory-map Z read-only (no copy) rather than read it into memory
+
+    returns
+    ------------
+    Z          : (2d array or np.memmap) the image
+    grid       : (ImageGrid) the image geometry
+    """
+
+    header,offset = _read_header(filename)
+    shape = tuple(header['shape'])
+
+    if mmap:
+        Z = np.memmap(filename,dtype=header['dtype'],mode='r',offset=offset,shape=shape)
+    else:
+        with open(filename,'rb') as f:
+            f.seek(offset)
+            Z = np.fromfile(f,dtype=header['dtype'],count=shape[0]*shape[1]).reshape(shape)
+
+    grid = ImageGrid(header['rowaxis'],header['colaxis'],uniform=header['uniform'])
+
+    return Z,grid
+
+
+def read_dat(filename):
+    """read a text image in the layout of the bundled .dat files
+
+    the values are parsed straight into one array (np.fromfile), so the
+    peak memory is about twice the result, rather than one Python string
+    per value; this is still the slow step the binary cache (load_dat)
+    does once.
+
+    returns
+    ------------
+    X,Y,Z      : (2d arrays) the coordinate and image arrays
+    """
+
+    with open(filename,'rb') as f:
+        xdim,ydim = [int(float(v)) for v in f.readline().split()[:2]]
+        values = np.fromfile(f,dtype=float,sep=' ')
+
+    if len(values) != 3*xdim*ydim:
+        raise ValueError('elliptical.imagefile.read_dat: {} holds {} values, expected 3x{}x{}.'.format(filename,len(values),xdim,ydim))
+
+    values = values.reshape(xdim,ydim,3)
+    return values[:,:,0].copy(),values[:,:,1].copy(),values[:,:,2].copy()
+
+
+def cache_directory():
+    """the user cache directory for load_dat: $XDG_CACHE_HOME/elliptical, or ~/.cache/elliptical"""
+
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'),'.cache')
+    return os.path.join(base,'elliptical')
+
+
+def load_dat(filename,cachefile=None,mmap=True):
+    """load a .dat text image through a binary cache
+
+    the first call parses the text and writes the cache; later calls only
+    memory-map the cache. the cache records the size and modification time
+    of the text file and is rebuilt when either changes. by default it goes
+    in the user cache directory (see cache_directory), or the temporary
+    directory if that cannot be written: never next to the text file (e.g.
+    into an installed package) unless asked, with cachefile=filename+'.eimg'.
+
+    inputs
+    ------------
+    filename   : (str) the .dat file
+    cachefile  : (str, optional) where to keep the cache, instead of the cache directories
+    mmap       : (bool) memory-map Z (see load_image)
+
+    returns
+    ------------
+    Z          : (2d array or np.memmap) the image
+    grid       : (ImageGrid) the image geometry; grid.meshgrid() gives X,Y
+    """
+
+    status = os.stat(filename)
+    source = {'path':os.path.abspath(filename),'size':status.st_size,'mtime_ns':status.st_mtime_ns}
+
+    if cachefile is None:
+        # the name carries a hash of the full path, so files of the same name do not collide
+        name = os.path.basename(filename) + '.' + hashlib.md5(source['path'].encode('utf-8')).hexdigest()[:12] + '.eimg'
+        candidates = [os.path.join(cache_directory(),name),
+                      os.path.join(tempfile.gettempdir(),'elliptical-cache',name)]
+    else:
+        candidates = [cachefile]
+
+    for candidate in candidates:
+        if os.path.exists(candidate):
+            try:
+                header,_ = _read_header(candidate)
+            except ValueError:
+                continue
+            if header.get('source') == source:
+                return load_image(candidate,mmap=mmap)
+
+    X,Y,Z = read_dat(filename)
+    grid  = ImageGrid.from_xy(X,Y)
+
+    for candidate in candidates:
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(candidate)),exist_ok=True)
+            save_image(candidate,Z,grid,source=source)
+            return load_image(candidate,mmap=mmap)
+        except OSError:
+            continue
+
+    # nowhere to write: return the parsed image
+    return Z,grid
+
+
+def _read_header(filename):
+    """the JSON header of an image file, and the byte offset of the data"""
+
+    with open(filename,'rb') as f:
+        magic = f.read(len(_MAGIC))
+        if magic != _MAGIC:
+            raise ValueError('elliptical.imagefile.load_image: {} is not an elliptical image file.'.format(filename))
+        length = int(np.frombuffer(f.read(8),dtype='<u8')[0])
+        header = json.loads(f.read(length).decode('utf-8'))
+
+    if header.get('version',0) > _VERSION:
+        raise ValueError('elliptical.imagefile.load_image: {} was written by a newer version (file version {}).'.format(filename,header['version']))
+
+    return header,len(_MAGIC) + 8 + length
@@ -0,0 +1,198 @@
+"""imaging
+
+face-on surface density images from particles, ready for map_ellipses
+
+surface_density :
+  histogram particle positions (and masses) onto a grid in fixed-size
+  chunks, so memory-mapped snapshots never have to be read in whole,
+  then smooth and take log10
+
+histogram_particles :
+  the chunked np.bincount histogram on its own
+
+gaussian_smooth :
+  separable Gaussian smoothing of an image
+
+
+the output X,Y,Z follow the layout of the bundled test images (and of
+exptool's visualize.kde_pos): 'xy' meshgrid indexing, with x along the
+columns and y along the rows.
+
+"""
+
+import numpy as np
+
+
+def surface_density(x,y,mass=None,extent=0.06,gridsize=128,smooth=None,chunksize=1000000,log=True,floor=None):
+    """the face-on surface density of particles, as X,Y,Z for map_ellipses
+
+    large snapshots can be passed as memory-mapped arrays, e.g.
+    np.load('x.npy',mmap_mode='r'): only chunksize particles are read
+    and held at any one time.
+
+    inputs
+    ------------
+    x,y        : (1d arrays) particle positions
+    mass       : (1d array or float, optional) particle masses. if None, every particle has mass 1.
+    extent     : (float or 4 floats) half-width of the square image, as kde_pos face_extents,
+                 or (xmin,xmax,ymin,ymax)
+    gridsize   : (int or 2 ints) number of pixels along x and y
+    smooth     : (float or 2 floats, optional) Gaussian smoothing length along x and y,
+                 in the units of x and y. no smoothing if None.
+    chunksize  : (int) number of particles read at a time
+    log        : (bool) return log10 of the surface density
+    floor      : (float, optional) the value given to empty pixels when log is True.
+                 if None, they are NaN, which the contour tracing skips.
+
+    returns
+    ------------
+    X,Y,Z      : (2d arrays) (ny,nx) pixel centres and surface density (mass per unit area)
+    """
+
+    xedges,yedges = _edges(extent,gridsize)
+
+    H = histogram_particles(x,y,mass,xedges,yedges,chunksize=chunksize)
+
+    dx,dy = xedges[1]-xedges[0],yedges[1]-yedges[0]
+
+    if smooth is not None:
+        sx,sy = np.broadcast_to(np.asarray(smooth,dtype=float),(2,))
+        H = gaussian_smooth(H,(sy/dy,sx/dx))
+
+    Z = H/(dx*dy)
+
+    if log:
+        with np.errstate(divide='ignore'):
+            Z = np.where(Z > 0.,np.log10(np.where(Z > 0.,Z,1.)),np.nan if floor is None else floor)
+
+    X,Y = np.meshgrid(0.5*(xedges[1:]+xedges[:-1]),0.5*(yedges[1:]+yedges[:-1]))
+
+    return X,Y,Z
+
+
+def histogram_particles(x,y,mass,xedges,yedges,chunksize=1000000):
+    """the mass in each pixel, accumulated over chunks of particles
+
+    the pixels are uniform, so each particle's pixel is found arithmetically
+    and all pixels are summed with a single np.bincount per chunk. particles
+    outside the edges are left out.
+
+    inputs
+    ------------
+    x,y        : (1d arrays) particle positions (may be memory-mapped)
+    mass       : (1d array, float or None) particle masses
+    xedges     : (1d array) the nx+1 uniform pixel edges along x
+    yedges     : (1d array) the ny+1 uniform pixel edges along y
+    chunksize  : (int) number of particles read at a time
+
+    returns
+    ------------
+    H          : (2d array) (ny,nx) summed mass, y along the rows
+    """
+
+    nparticles = len(x)
+
+    if len(y) != nparticles:
+        raise ValueError('elliptical.imaging.histogram_particles: x and y must have the same length.')
+
+    if (mass is not None) and (np.ndim(mass) > 0) and (len(mass) != nparticles):
+        raise ValueError('elliptical.imaging.histogram_particles: mass must be a scalar or have the length of x.')
+
+    if chunksize < 1:
+        raise ValueError('elliptical.imaging.histogram_particles: chunksize must be at least 1.')
+
+    nx,ny = len(xedges)-1,len(yedges)-1
+    x0,dx = float(xedges[0]),float(xedges[1]-xedges[0])
+    y0,dy = float(yedges[0]),float(yedges[1]-yedges[0])
+
+    H = np.zeros(nx*ny)
+
+    for start in range(0,nparticles,chunksize):
+
+        xc = np.asarray(x[start:start+chunksize],dtype=np.float64)
+        yc = np.asarray(y[start:start+chunksize],dtype=np.float64)
+
+        # fractional pixel positions; the last edge is inside, as in np.histogram2d
+        fx = (xc - x0)/dx
+        fy = (yc - y0)/dy
+        ix = np.minimum(np.floor(fx),nx-1)
+        iy = np.minimum(np.floor(fy),ny-1)
+
+        inside = (fx >= 0.) & (fx <= nx) & (fy >= 0.) & (fy <= ny)
+        pixel  = (iy[inside]*nx + ix[inside]).astype(np.intp)
+
+        if (mass is None) or (np.ndim(mass) == 0):
+            counts = np.bincount(pixel,minlength=nx*ny)
+            H += counts if mass is None else float(mass)*counts
+        else:
+            mc = np.asarray(mass[start:start+chunksize],dtype=np.float64)
+            H += np.bincount(pixel,weights=mc[inside],minlength=nx*ny)
+
+    return H.reshape(ny,nx)
+
+
+def gaussian_smooth(H,sigma,truncate=4.):
+    """smooth an image with a Gaussian, one axis at a time
+
+    the kernel is normalised and cut at truncate*sigma; the image is taken
+    to be zero beyond its edges, so mass near the edges is spread outwards
+    and partly lost, as for particles outside the image.
+
+    inputs
+    ------------
+    H          : (2d array) the image
+    sigma      : (float or 2 floats) the Gaussian width in pixels, along the rows and columns
+    truncate   : (float) the kernel half-width, in units of sigma
+
+    returns
+    ------------
+    S          : (2d array) the smoothed image
+    """
+
+    S = np.asarray(H,dtype=np.float64)
+
+    for axis,width in enumerate(np.broadcast_to(np.asarray(sigma,dtype=float),(2,))):
+
+        if width <= 0.:
+            continue
+
+        kernel = _gaussian_kernel(width,truncate)
+        half   = len(kernel)//2
+
+        padding = [(0,0),(0,0)]
+        padding[axis] = (half,half)
+        P = np.pad(S,padding)
+
+        # one shifted, weighted copy per pair of (symmetric) kernel taps
+        n = S.shape[axis]
+        shifted = (lambda k: P[k:k+n]) if axis == 0 else (lambda k: P[:,k:k+n])
+        S = kernel[half]*shifted(half)
+        for k in range(half):
+            S += kernel[k]*(shifted(k) + shifted(2*half-k))
+
+    return S
+
+
+def _gaussian_kernel(sigma,truncate=4.):
+    """normalised 1d Gaussian weights, sigma in pixels"""
+
+    half = max(int(truncate*sigma + 0.5),1)
+    u = np.arange(-half,half+1)
+    kernel = np.exp(-0.5*(u/sigma)**2)
+    return kernel/kernel.sum()
+
+
+def _edges(extent,gridsize):
+    """the uniform pixel edges along x and y"""
+
+    if np.ndim(extent) == 0:
+        xmin,xmax,ymin,ymax = -extent,extent,-extent,extent
+    else:
+        xmin,xmax,ymin,ymax = extent
+
+    nx,ny = np.broadcast_to(np.asarray(gridsize,dtype=int),(2,))
+
+    if (nx < 2) or (ny < 2) or (xmax <= xmin) or (ymax <= ymin):
+        raise ValueError('elliptical.imaging.surface_density: the image needs at least 2x2 pixels and a positive extent.')
+
+    return np.linspace(xmin,xmax,nx+1),np.linspace(ymin,ymax,ny+1)
@@ -1,6 +1,12 @@
 """
 different measures for ellipses
 
+measureEllipse :
+  the bar lengths of one map_ellipses result
+
+measure_profiles :
+  the same bar lengths for many profiles at once (see stack_profiles)
+
 
 references:
 Muñoz-Mateos et al. (2013) https://ui.adsabs.harvard.edu/abs/2013ApJ...771...59M/abstract
@@ -9,15 +15,35 @@ Muñoz-Mateos et al. (2013) https://ui.adsabs.harvard.edu/abs/2013ApJ...771...59
 
 import numpy as np
 
+from .table import EllipseTable
+
 class measureEllipse(object):
     '''take a dictionary of ellipses (sorted by semi-major axis length) and return a smattering of measurements.
 
+    each measurement is an axis length, or NaN if its criterion is not met
+    by the profile (bestellipse is then None).
+
+    the measurements are computed when first used, with the thresholds in
+    params; changing a threshold in params changes the next measurement.
+    sweep evaluates one criterion over many thresholds at once.
 
     '''
-    def __init__(self,M,method='pachange'):
-        '''constructor. calls out for other measurements.
 
-        M :
+    # the criteria that take a threshold: the method, and its name in params
+    _thresholds = {'ellipdrop'      : ('_ellip_drop','ellipdrop'),
+                   'ellipdroplimit' : ('_ellip_drop_below','ell_threshold'),
+                   'ellipchange'    : ('_ellip_change','el_change'),
+                   'pachange'       : ('_pa_change','pa_change')}
+
+    def __init__(self,M,method='pachange',ellipdrop=0.4,ellipdroplimit=0.4,ellipchange=0.1,pachange=10.):
+        '''constructor. prepares the profiles for the measurements.
+
+        M              : (dict or EllipseTable) the ellipses, as returned by map_ellipses
+        method         : (string) the measurement used for bestellipse
+        ellipdrop      : (float) sequential ellipticity drop (see _ellip_drop)
+        ellipdroplimit : (float) ellipticity threshold (see _ellip_drop_below)
+        ellipchange    : (float) ellipticity change from the maximum (see _ellip_change)
+        pachange       : (float) position angle change, in degrees (see _pa_change)
 
         '''
 
@@ -26,18 +52,29 @@ class measureEllipse(object):
 
         # record the parameters used in measurements
         self.params = dict()
+        self.params['ellipdrop']     = ellipdrop
+        self.params['ell_threshold'] = ellipdroplimit
+        self.params['el_change']     = ellipchange
+        self.params['pa_change']     = pachange
 
         # prep the arrays
-        sma = np.zeros(nlevels)
-        ecc = np.zeros(nlevels)
-        phi = np.zeros(nlevels)
-        indx= np.zeros(nlevels)
+        if isinstance(M,EllipseTable):
+            sma = M.a.copy()
+            ecc = M.e.copy()
+            phi = M.p.copy()
+            indx= np.arange(nlevels,dtype=float)
 
-        for ik,k in enumerate(M.keys()):
-            sma[ik] = M[k]['a']
-            ecc[ik] = M[k]['e']
-            phi[ik] = M[k]['p']
-            indx[ik]= k
+        else:
+            sma = np.zeros(nlevels)
+            ecc = np.zeros(nlevels)
+            phi = np.zeros(nlevels)
+            indx= np.zeros(nlevels)
+
+            for ik,k in enumerate(M.keys()):
+                sma[ik] = M[k]['a']
+                ecc[ik] = M[k]['e']
+                phi[ik] = M[k]['p']
+                indx[ik]= k
 
         # check that the sorting is correct: a problem if not?
         asort = sma.argsort()
@@ -47,30 +84,105 @@ class measureEllipse(object):
         self.ecc = ecc[::-1]#[asort]
         self.phi = phi[::-1]#[asort]
         self.indx= indx[::-1]#[asort]
+        self.nlevels = nlevels
+
+        self.M      = M
+        self.method = method
+
+        # measurements made so far, by criterion and threshold
+        self._measured = dict()
+
+    # the lengths, computed on first use
+    @property
+    def ellipdrop(self):
+        return self._measure('ellipdrop')
+
+    @property
+    def maxellip(self):
+        return self._measure('maxellip')
+
+    @property
+    def localellipmin(self):
+        return self._measure('localellipmin')
+
+    @property
+    def ellipdroplimit(self):
+        return self._measure('ellipdroplimit')
+
+    @property
+    def maxellipdrop(self):
+        return self._measure('maxellipdrop')
+
+    @property
+    def ellipchange(self):
+        return self._measure('ellipchange')
+
+    @property
+    def pachange(self):
+        return self._measure('pachange')
+
+    @property
+    def bestellipse(self):
+        """the ellipse at the bar length given by method, or None if there is none"""
+
+        if self.method == 'pachange':
+            bar_length = self.pachange
+        elif self.method == 'localellipmin':
+            bar_length = self.localellipmin
+        elif self.method == 'ellipchange':
+            bar_length = self.ellipchange
+        else:
+            bar_length = self.maxellip
+
+        # the criterion may not be met: then there is no best ellipse
+        if np.isnan(bar_length):
+            return None
+
+        best_ellipse = np.where(self.sma[::-1]==bar_length)[0][0]
+        return self.M[best_ellipse]
+
+    def _measure(self,criterion):
+        """the length for criterion at the current threshold, computed once"""
+
+        if criterion in measureEllipse._thresholds:
+            method,param = measureEllipse._thresholds[criterion]
+            key = (criterion,self.params[param])
+            if key not in self._measured:
+                self._measured[key] = getattr(self,method)(self.params[param])
 
-        # now we are ready to compute lengths
-        self.ellipdrop      = self._ellip_drop()
-        self.maxellip       = self._max_ellip()
-        self.localellipmin  = self._first_ellip_min()
-        self.ellipdroplimit = self._ellip_drop_below()
-        self.maxellipdrop   = self._max_ellip_drop()
-        self.ellipchange    = self._ellip_change()
-        self.pachange       = self._pa_change()
-
-
-        if method == 'pachange':
-            best_ellipse = np.where(sma==self.pachange)[0][0]
-        elif method == 'localellipmin':
-            best_ellipse = np.where(sma==self.localellipmin)[0][0]
-        elif method == 'ellipchange':
-            best_ellipse = np.where(sma==self.ellipchange)[0][0]
         else:
-            best_ellipse = np.where(sma==self.maxellip)[0][0]
+            key = (criterion,None)
+            if key not in self._measured:
+                if criterion == 'maxellip':
+                    self._measured[key] = self._max_ellip()
+                elif criterion == 'localellipmin':
+                    self._measured[key] = self._first_ellip_min()
+                else:
+                    self._measured[key] = self._max_ellip_drop()
+
+        return self._measured[key]
 
-        # necessary optional logic check
-        #print(best_ellipse,self.pachange,M[self.indx[best_ellipse]]['a'],M[best_ellipse]['a'])
+    def sweep(self,criterion,thresholds):
+        """evaluate one criterion over many thresholds at once
 
-        self.bestellipse = M[best_ellipse]
+        inputs
+        ------------
+        criterion  : (string) 'ellipdrop', 'ellipdroplimit', 'ellipchange' or 'pachange'
+        thresholds : (array) the thresholds, in the units of the criterion
+                     (degrees for pachange)
+
+        returns
+        ------------
+        lengths    : (array) the length at each threshold, NaN where the criterion is not met
+
+        for example, sweep('pachange',np.linspace(1.,30.,30)).
+        """
+
+        if criterion not in measureEllipse._thresholds:
+            raise ValueError('elliptical.measure.measureEllipse.sweep: {} has no threshold to sweep.'.format(criterion))
+
+        method,param = measureEllipse._thresholds[criterion]
+        return getattr(self,method)(np.asarray(thresholds,dtype=float))
 
 
     def print_diagnostics(self):
@@ -90,55 +202,20 @@ class measureEllipse(object):
         '''
         given a list of axis lengths, calculate the length of the bar based on some specified ellipticity drop
 
-        '''
-
-        self.params['ellipdrop'] = drop
-
-        found = False
-        j = 2
-
-        while found==False:
-
-            # compute the different in eccentricity from one bin to the next
-            d = self.ecc[j-1] - self.ecc[j]
+        if no drop is found, this is the innermost axis length, as before.
 
-            if d > drop:
-                found = True
-                #print('INDEX VALUE is {0:d}'.format(j-1))
-
-            j += 1
-
-            if j==len(self.sma):
-                found = True
-                j=2
-
-        return self.sma[j-2]
+        '''
+        return _take(self.sma,_ellip_drop_index(self.ecc,self.nlevels,drop))
 
     def _ellip_drop_below(self,drop=0.4):
         '''where does the ellipticity first drop below some value?
 
         '''
-
-        self.params['ell_threshold'] = drop
-
-        # find all the bins where the ellipticity is above some value (excluded)
-        lessthan = np.where( self.ecc >= drop )[0]
-
-        # find the minimum nonzero index
-        if len(lessthan) > 0:
-            if np.max(lessthan) < 1:
-                minbin = 1
-            else:
-                minbin = np.max(lessthan)
-        else:
-            minbin = 1
-
-        return self.sma[minbin]
+        return _take(self.sma,_ellip_drop_below_index(self.ecc,self.nlevels,drop))
 
     def _max_ellip_drop(self):
         """location of largest eccentricity change"""
-        edrop = np.ediff1d(self.ecc,to_end=0.)
-        return self.sma[ np.where(np.min(edrop)==edrop)[0][0]]
+        return _take(self.sma,_max_ellip_drop_index(self.ecc,self.nlevels))
 
     def _max_ellip(self):
         """location of maximum ellipticity
@@ -146,7 +223,7 @@ class measureEllipse(object):
         proposed in Munoz-Mateos+ 2013, S3.4 (#1)
         this is treated as the minimum bar length.
         """
-        return self.sma[np.nanargmax(self.ecc)]
+        return _take(self.sma,_max_ellip_index(self.ecc,self.nlevels))
 
     def _first_ellip_min(self):
         """location of the first local minimum in the ellipticity after the maximum
@@ -156,17 +233,7 @@ class measureEllipse(object):
 
 
         """
-
-        ellip_index = np.nanargmax(self.ecc)
-        max_ellip_value = np.nanmax(self.ecc)
-
-        echange = np.ediff1d(self.ecc,to_end=0.)
-
-        # can put in some tolerance to avoid little wiggles
-        while (echange[ellip_index] < 0.):
-            ellip_index += 1
-
-        return self.sma[ellip_index-1]
+        return _take(self.sma,_first_ellip_min_index(self.ecc,self.nlevels))
 
 
     def _ellip_change(self,change=0.1):
@@ -177,19 +244,7 @@ class measureEllipse(object):
 
 
         """
-
-        self.params['el_change'] = change
-
-        ellip_index = np.nanargmax(self.ecc)
-        max_ellip_value = np.nanmax(self.ecc)
-
-        ellip_diff = 0.
-
-        while (ellip_diff < change):
-            ellip_index += 1
-            ellip_diff = np.abs(self.ecc[ellip_index] - max_ellip_value)
-
-        return self.sma[ellip_index-1]
+        return _take(self.sma,_ellip_change_index(self.ecc,self.nlevels,change))
 
 
     def _pa_change(self,change=10.):
@@ -203,25 +258,218 @@ class measureEllipse(object):
         inputs
         ------------
         self
-        change    : the position angle change tolerance, in degrees.
+        change    : the position angle change tolerance, in degrees (or an array of them).
 
         """
-        # change must be in degrees
+        return _take(self.sma,_pa_change_index(self.ecc,self.phi,self.nlevels,change))
+
+
+# the criteria, as array operations
+#
+# each takes profiles ordered from the innermost ellipse out, along the
+# last axis, with nlevels valid entries (any padding comes after them),
+# and returns the index of the bar length along that axis, or -1 where
+# the criterion is not met. thresholds broadcast against the leading
+# (profile) axes.
+
+def _first_true(mask):
+    """index of the first True along the last axis, -1 if there is none"""
+    if mask.shape[-1] == 0:
+        return np.full(mask.shape[:-1],-1)
+    return np.where(np.any(mask,axis=-1),np.argmax(mask,axis=-1),-1)
+
+
+def _last_true(mask):
+    """index of the last True along the last axis, -1 if there is none"""
+    if mask.shape[-1] == 0:
+        return np.full(mask.shape[:-1],-1)
+    return np.where(np.any(mask,axis=-1),mask.shape[-1] - 1 - np.argmax(mask[...,::-1],axis=-1),-1)
+
+
+def _take(values,index):
+    """values at index along the last axis, NaN where index is -1"""
+
+    index  = np.asarray(index)
+    values = np.broadcast_to(values,np.broadcast_shapes(index.shape,values.shape[:-1]) + values.shape[-1:])
+    if values.shape[-1] == 0:
+        return np.full(values.shape[:-1],np.nan)[()]
+    found = np.take_along_axis(values,np.maximum(index,0)[...,np.newaxis],axis=-1)[...,0]
+    return np.where(index >= 0,found,np.nan)[()]
+
+
+def _next_diff(ecc,nlevels):
+    """ecc[j+1]-ecc[j], zero at the last valid entry (as np.ediff1d(ecc,to_end=0.))"""
+
+    ediff = np.zeros_like(ecc)
+    ediff[...,:-1] = ecc[...,1:] - ecc[...,:-1]
+    j = np.arange(ecc.shape[-1])
+    return np.where(j == np.asarray(nlevels)[...,np.newaxis]-1,0.,ediff)
+
+
+def _max_ellip_index(ecc,nlevels):
+    j = np.arange(ecc.shape[-1])
+    valid = (j < np.asarray(nlevels)[...,np.newaxis]) & ~np.isnan(ecc)
+    emax  = np.max(np.where(valid,ecc,-np.inf),axis=-1,initial=-np.inf)
+    return _first_true(valid & (ecc == emax[...,np.newaxis]))
+
+
+def _ellip_drop_index(ecc,nlevels,drop):
+    j      = np.arange(ecc.shape[-1])
+    nlevels= np.asarray(nlevels)
+
+    # drop from j-1 to j, for 2 <= j <= nlevels-2
+    d = np.full_like(ecc,np.nan)
+    d[...,1:] = ecc[...,:-1] - ecc[...,1:]
+
+    with np.errstate(invalid='ignore'):
+        dropped = (d > np.asarray(drop)[...,np.newaxis]) & (j >= 2) & (j <= nlevels[...,np.newaxis]-2)
+
+    first = _first_true(dropped)
+
+    # no drop: the innermost ellipse. too short to look: not found
+    return np.where(nlevels < 3,-1,np.where(first > 0,first-1,0))
 
-        self.params['pa_change'] = change
 
-        ellip_index = np.nanargmax(self.ecc)
-        pa_value = self.phi[ellip_index]
-        pa_diff = 0.
+def _ellip_drop_below_index(ecc,nlevels,drop):
+    j       = np.arange(ecc.shape[-1])
+    nlevels = np.asarray(nlevels)
 
-        while (pa_diff < change):
-            ellip_index += 1
+    with np.errstate(invalid='ignore'):
+        above = (ecc >= np.asarray(drop)[...,np.newaxis]) & (j < nlevels[...,np.newaxis])
 
-            # guard against a possible failure mode
-            if ellip_index == len(self.phi):
-                print('PA change method failed.')
-                return self.sma[ellip_index-1]
+    last = _last_true(above)
+    return np.where(nlevels < 2,-1,np.maximum(last,1))
 
-            pa_diff = np.abs(self.phi[ellip_index] - pa_value)*180./np.pi
 
-        return self.sma[ellip_index-1]
+def _max_ellip_drop_index(ecc,nlevels):
+    j       = np.arange(ecc.shape[-1])
+    nlevels = np.asarray(nlevels)
+
+    edrop = np.where(j < nlevels[...,np.newaxis],_next_diff(ecc,nlevels),np.inf)
+    emin  = np.min(np.where(np.isnan(edrop),np.inf,edrop),axis=-1,initial=np.inf)
+    first = _first_true(edrop == emin[...,np.newaxis])
+
+    # a NaN ellipticity leaves the largest drop undefined
+    return np.where((nlevels < 1) | np.any(np.isnan(edrop),axis=-1),-1,first)
+
+
+def _first_ellip_min_index(ecc,nlevels):
+    j     = np.arange(ecc.shape[-1])
+    imax  = _max_ellip_index(ecc,nlevels)
+
+    # the ellipticity falls from the maximum until the first step that does not
+    echange = _next_diff(ecc,nlevels)
+    with np.errstate(invalid='ignore'):
+        stops = ~(echange < 0.) & (j >= imax[...,np.newaxis])
+
+    stop = _first_true(stops)
+    return np.where((imax < 0) | (stop < 1),-1,stop-1)
+
+
+def _ellip_change_index(ecc,nlevels,change):
+    j     = np.arange(ecc.shape[-1])
+    imax  = _max_ellip_index(ecc,nlevels)
+    emax  = np.asarray(_take(ecc,imax))[...,np.newaxis]
+
+    with np.errstate(invalid='ignore'):
+        changed = ~(np.abs(ecc - emax) < np.asarray(change)[...,np.newaxis])
+
+    changed &= (j > imax[...,np.newaxis]) & (j < np.asarray(nlevels)[...,np.newaxis])
+
+    first = _first_true(changed)
+    return np.where((imax < 0) | (first < 0),-1,first-1)
+
+
+def _pa_change_index(ecc,phi,nlevels,change):
+    j     = np.arange(ecc.shape[-1])
+    imax  = _max_ellip_index(ecc,nlevels)
+    pa    = np.asarray(_take(phi,imax))[...,np.newaxis]
+
+    with np.errstate(invalid='ignore'):
+        changed = ~(np.abs(phi - pa)*180./np.pi < np.asarray(change)[...,np.newaxis])
+
+    changed &= (j > imax[...,np.newaxis]) & (j < np.asarray(nlevels)[...,np.newaxis])
+
+    first = _first_true(changed)
+    return np.where((imax < 0) | (first < 0),-1,first-1)
+
+
+def stack_profiles(Ms):
+    """pack the profiles of many map_ellipses results into padded arrays
+
+    inputs
+    ------------
+    Ms         : (list) map_ellipses results (dictionaries or EllipseTables)
+
+    returns
+    ------------
+    sma,ecc,phi : (2d arrays) (n_profiles,n_levels), in map_ellipses order,
+                  padded with NaN after the last level of shorter profiles
+    """
+
+    nlevels = max([len(M) for M in Ms],default=0)
+
+    sma = np.full((len(Ms),nlevels),np.nan)
+    ecc = np.full((len(Ms),nlevels),np.nan)
+    phi = np.full((len(Ms),nlevels),np.nan)
+
+    for i,M in enumerate(Ms):
+        if isinstance(M,EllipseTable):
+            a,e,p = M.a,M.e,M.p
+        else:
+            a = [M[k]['a'] for k in M.keys()]
+            e = [M[k]['e'] for k in M.keys()]
+            p = [M[k]['p'] for k in M.keys()]
+
+        sma[i,:len(M)] = a
+        ecc[i,:len(M)] = e
+        phi[i,:len(M)] = p
+
+    return sma,ecc,phi
+
+
+def measure_profiles(sma,ecc,phi,ellipdrop=0.4,ellipdroplimit=0.4,ellipchange=0.1,pachange=10.):
+    """every measureEllipse bar length, for many profiles at once
+
+    inputs
+    ------------
+    sma,ecc,phi     : (arrays) (n_profiles,n_levels) semi-major axes,
+                      ellipticities and position angles, in map_ellipses order
+                      (outermost ellipse first). shorter profiles are padded
+                      with NaN after their last level (see stack_profiles).
+                      a single 1d profile is also accepted.
+    ellipdrop       : (float) the sequential ellipticity drop (measureEllipse._ellip_drop)
+    ellipdroplimit  : (float) the ellipticity threshold (measureEllipse._ellip_drop_below)
+    ellipchange     : (float) the ellipticity change from the maximum (measureEllipse._ellip_change)
+    pachange        : (float) the position angle change, in degrees (measureEllipse._pa_change)
+
+    the thresholds may also be arrays that broadcast against the profile
+    axis, e.g. pachange=dphi[:,np.newaxis] for a (len(dphi),n_profiles) sweep.
+
+    returns
+    ------------
+    lengths         : (dict of arrays) for each measureEllipse bar length, the
+                      value for every profile. NaN where the criterion is not met.
+    """
+
+    sma = np.asarray(sma,dtype=float)
+    nlevels = np.sum(~np.isnan(sma),axis=-1)
+
+    # reverse the valid part of each profile, so the innermost ellipse comes first
+    j = np.arange(sma.shape[-1])
+    order = np.where(j < nlevels[...,np.newaxis],nlevels[...,np.newaxis]-1-j,j)
+
+    sma = np.take_along_axis(sma,order,axis=-1)
+    ecc = np.take_along_axis(np.asarray(ecc,dtype=float),order,axis=-1)
+    phi = np.take_along_axis(np.asarray(phi,dtype=float),order,axis=-1)
+
+    lengths = dict()
+    lengths['maxellip']       = _take(sma,_max_ellip_index(ecc,nlevels))
+    lengths['pachange']       = _take(sma,_pa_change_index(ecc,phi,nlevels,pachange))
+    lengths['ellipchange']    = _take(sma,_ellip_change_index(ecc,nlevels,ellipchange))
+    lengths['localellipmin']  = _take(sma,_first_ellip_min_index(ecc,nlevels))
+    lengths['maxellipdrop']   = _take(sma,_max_ellip_drop_index(ecc,nlevels))
+    lengths['ellipdroplimit'] = _take(sma,_ellip_drop_below_index(ecc,nlevels,ellipdroplimit))
+    lengths['ellipdrop']      = _take(sma,_ellip_drop_index(ecc,nlevels,ellipdrop))
+
+    return lengths
@@ -0,0 +1,246 @@
+"""profile
+
+measurements of the image inside traced ellipses
+
+ellipse_photometry :
+  enclosed and annular sums, means and pixel counts of an image, for
+  every ellipse of a map_ellipses result (or a single best-fit ellipse)
+
+sample_isophotes :
+  the image sampled along every fitted ellipse at once, with the
+  deviation from the contour level and its harmonic content
+
+
+"""
+
+import numpy as np
+
+from .ellipse import ellipse_labels, ellipse_mask
+from .table import EllipseTable
+
+
+def ellipse_photometry(M,Z,grid,C=2.):
+    """aperture photometry of Z in each traced ellipse
+
+    the pixels are labelled once by the smallest ellipse containing them
+    (see ellipse.ellipse_labels), summed per label with np.bincount, and
+    accumulated outwards with a cumulative sum: there is no mask per ellipse.
+
+    Z is summed as given: for the bundled log10 surface density images,
+    pass 10.**Z to measure the light. pixels where Z is not finite are
+    left out of the sums and the counts.
+
+    the labelling is exact for an ellipse that holds every smaller one (by
+    semi-major axis) and lies inside every larger one. traced ellipses can
+    cross, e.g. at the end of a bar where the semi-major axis is not
+    monotonic in the level. each ellipse is checked against all the others
+    along its boundary, and ellipses that are not nested are summed with
+    their own mask (ellipse.ellipse_mask), as are the annuli next to them.
+
+    inputs
+    ------------
+    M          : (dict or EllipseTable) the ellipses, as returned by map_ellipses,
+                 or the single ellipse dictionary from measureEllipse.bestellipse
+    Z          : (2d array) the image
+    grid       : (ImageGrid) the image geometry (see ellipse.ellipse_mask)
+    C          : (float) generalised ellipse exponent (see ellipse.ellipse_mask)
+
+    returns
+    ------------
+    P          : (dict of 1d arrays) for each ellipse, in the order of M
+      a             : semi-major axis
+      sum           : sum of Z inside the ellipse
+      count         : number of pixels inside the ellipse
+      mean          : mean of Z inside the ellipse
+      annulus_sum   : sum of Z between the ellipse and the next smaller one
+      annulus_count : number of pixels in that annulus
+      annulus_mean  : mean of Z in that annulus (the surface density profile)
+      nested        : (bool) the ellipse holds every smaller ellipse and lies inside
+                      every larger one. if False, its sums come from its own mask.
+    """
+
+    table = _as_table(M)
+    nell  = len(table)
+
+    labels = ellipse_labels(table,grid,C=C)
+
+    # the position of each ellipse in the nested order, smallest first
+    order = np.argsort(table.a,kind='stable')
+    rank  = np.empty(nell,dtype=int)
+    rank[order] = np.arange(nell)
+
+    Z    = np.asarray(Z)
+    used = (labels >= 0) & np.isfinite(Z)
+    bins = rank[labels[used]]
+
+    counts = np.bincount(bins,minlength=nell)
+    sums   = np.bincount(bins,weights=Z[used],minlength=nell)
+
+    P = dict()
+    P['a']             = table.a.copy()
+    P['sum']           = np.cumsum(sums)[rank]
+    P['count']         = np.cumsum(counts)[rank]
+    P['annulus_sum']   = sums[rank]
+    P['annulus_count'] = counts[rank]
+    P['nested']        = _nested(table,order,C=C)
+
+    # crossing ellipses: the pixels of each from its own mask
+    finite = np.isfinite(Z).ravel()
+    values = Z.ravel()
+    pixels = dict()
+
+    def inside(k):
+        if k not in pixels:
+            index = ellipse_mask(table.a[k],table.b[k],table.p[k],table.xc[k],table.yc[k],grid,C=C,flat=True)
+            pixels[k] = index[finite[index]]
+        return pixels[k]
+
+    for k in np.flatnonzero(~P['nested']):
+        P['sum'][k]   = values[inside(k)].sum()
+        P['count'][k] = len(inside(k))
+
+    for position in range(nell):
+        k = order[position]
+        smaller = order[position-1] if position > 0 else None
+        if P['nested'][k] and ((smaller is None) or P['nested'][smaller]):
+            continue
+        annulus = inside(k) if smaller is None else np.setdiff1d(inside(k),inside(smaller),assume_unique=True)
+        P['annulus_sum'][k]   = values[annulus].sum()
+        P['annulus_count'][k] = len(annulus)
+
+    with np.errstate(invalid='ignore',divide='ignore'):
+        P['mean']         = P['sum']/P['count']
+        P['annulus_mean'] = P['annulus_sum']/P['annulus_count']
+
+    return P
+
+
+def sample_isophotes(M,Z,grid,nth=128,nharmonics=4):
+    """sample Z along every fitted ellipse, to check the quality of the fits
+
+    all curves are generated together and Z is bilinearly interpolated at
+    every point in one call. a perfect fit of
+    a contour samples the contour level l all the way round.
+
+    inputs
+    ------------
+    M          : (dict or EllipseTable) the ellipses, as returned by map_ellipses,
+                 or a single ellipse dictionary
+    Z          : (2d array) the image the ellipses were traced on
+    grid       : (ImageGrid) the image geometry
+    nth        : (int) the number of points around each ellipse
+    nharmonics : (int) the number of harmonics of the residual to return
+
+    returns
+    ------------
+    S          : (dict)
+      theta      : (1d array) (nth,) the ellipse angle of each sample
+      Z          : (2d array) (N,nth) Z along each ellipse, NaN off the image
+      rms        : (1d array) (N,) rms of Z - l along each ellipse
+      harmonics  : (2d array) (N,nharmonics+1) amplitudes of the Fourier
+                   harmonics 0..nharmonics of Z - l around each ellipse
+                   (0 is the mean offset). NaN for ellipses that leave the image.
+    """
+
+    table = _as_table(M)
+
+    theta = np.linspace(0.,2*np.pi,nth,endpoint=False)
+
+    # every curve at once: yc is the row centre and xc the column centre,
+    # and phi is measured from the row axis (see ellipse.ellipse_mask)
+    a,b,phi = table.a[:,np.newaxis],table.b[:,np.newaxis],table.p[:,np.newaxis]
+    u,v     = a*np.cos(theta),b*np.sin(theta)
+    row = table.yc[:,np.newaxis] + u*np.cos(phi) - v*np.sin(phi)
+    col = table.xc[:,np.newaxis] + u*np.sin(phi) + v*np.cos(phi)
+
+    index  = grid.coords_to_index(np.column_stack([row.ravel(),col.ravel()]))
+    values = _bilinear(np.asarray(Z,dtype=float),index).reshape(row.shape)
+
+    residual = values - table.l[:,np.newaxis]
+
+    S = dict()
+    S['theta'] = theta
+    S['Z']     = values
+
+    with np.errstate(invalid='ignore'):
+        S['rms'] = np.sqrt(np.nanmean(residual*residual,axis=1))
+
+    # harmonic amplitudes, in the units of Z
+    coefficients = np.abs(np.fft.rfft(residual,axis=1))[:,:nharmonics+1]/nth
+    coefficients[:,1:] *= 2.
+    S['harmonics'] = np.where(np.all(np.isfinite(residual),axis=1)[:,np.newaxis],coefficients,np.nan)
+
+    return S
+
+
+def _nested(table,order,C=2.,nth=64):
+    """for each ellipse, whether it holds every smaller ellipse and lies inside every larger one
+
+    the ellipses are compared along nth points of their boundaries, one
+    containing ellipse at a time against the boundaries of all the others.
+    order is the nested order (argsort of the semi-major axis).
+    """
+
+    nell = len(table)
+
+    # the boundary of each (generalised) ellipse, in the nested order, as row
+    # and column coordinates: phi is measured from the row axis (see ellipse.ellipse_mask)
+    th = np.linspace(0.,2*np.pi,nth,endpoint=False)
+    u  = np.sign(np.cos(th))*np.abs(np.cos(th))**(2./C)
+    v  = np.sign(np.sin(th))*np.abs(np.sin(th))**(2./C)
+
+    a,b,phi = table.a[order,np.newaxis],table.b[order,np.newaxis],table.p[order,np.newaxis]
+    xc,yc   = table.xc[order,np.newaxis],table.yc[order,np.newaxis]
+
+    row = yc + a*u*np.cos(phi) - b*v*np.sin(phi)
+    col = xc + a*u*np.sin(phi) + b*v*np.cos(phi)
+
+    # contains[i,j]: ellipse j (in nested order) holds the boundary of ellipse i
+    contains = np.empty((nell,nell),dtype=bool)
+    for j in range(nell):
+        drow,dcol = row - yc[j],col - xc[j]
+        xell =  drow*np.cos(phi[j]) + dcol*np.sin(phi[j])
+        yell = -drow*np.sin(phi[j]) + dcol*np.cos(phi[j])
+        contains[:,j] = np.all((np.abs(xell/a[j])**C + np.abs(yell/b[j])**C) <= 1. + 1.e-9,axis=1)
+
+    # every smaller ellipse inside, and inside every larger one
+    larger = np.triu(np.ones((nell,nell),dtype=bool),1)
+    nested = np.all(contains | ~larger,axis=0) & np.all(contains | ~larger,axis=1)
+
+    result = np.empty(nell,dtype=bool)
+    result[order] = nested
+    return result
+
+
+def _bilinear(Z,index):
+    """bilinear interpolation of Z at (K,2) fractional (row,column) indices, NaN off the image"""
+
+    nrow,ncol = Z.shape
+
+    with np.errstate(invalid='ignore'):
+        onimage = (index[:,0] >= 0) & (index[:,0] <= nrow-1) & (index[:,1] >= 0) & (index[:,1] <= ncol-1)
+
+    row = np.where(onimage,index[:,0],0.)
+    col = np.where(onimage,index[:,1],0.)
+
+    r0 = np.clip(np.floor(row).astype(int),0,nrow-2)
+    c0 = np.clip(np.floor(col).astype(int),0,ncol-2)
+    fr = row - r0
+    fc = col - c0
+
+    values = Z[r0,c0]*(1-fr)*(1-fc) + Z[r0+1,c0]*fr*(1-fc) + Z[r0,c0+1]*(1-fr)*fc + Z[r0+1,c0+1]*fr*fc
+
+    return np.where(onimage,values,np.nan)
+
+
+def _as_table(M):
+    """an EllipseTable from a map_ellipses result or a single ellipse dictionary"""
+
+    if isinstance(M,EllipseTable):
+        return M
+
+    # a single ellipse, e.g. measureEllipse.bestellipse
+    if 'a' in M.keys():
+        return EllipseTable([M['a']],[M['b']],[M['p']],[M['l']],[M['xc']],[M['yc']])
+
+    return EllipseTable.from_dict(M)
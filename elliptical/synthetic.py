@@ -0,0 +1,182 @@
+"""synthetic
+
+analytic barred galaxy images, with known bar parameters, for accuracy
+checks and benchmarks that need neither data files nor exptool
+
+barred_galaxy :
+  the surface density of an exponential disc and a Ferrers bar with a
+  generalised-ellipse (boxy) shape, seen at an inclination, with noise
+
+barred_galaxy_stack :
+  a stack of snapshots of the same galaxy with the bar rotating
+
+
+the images follow the layout of the bundled test images: 'xy' meshgrid
+indexing, with x along the columns and y along the rows, and log10 of the
+surface density in Z. the line of nodes is the x axis.
+
+"""
+
+import numpy as np
+
+from .ellipse import Ellipse
+
+
+def barred_galaxy(size=512,extent=6.,disc_scale=1.,bar_length=2.,bar_axis_ratio=0.4,bar_c=2.5,bar_pa=0.,
+                  bar_amplitude=2.,ferrers_n=2.,inclination=0.,noise=0.,noise_scale=0.1,rng=None,log=True,dtype=np.float64,chunksize=512):
+    """the image of an exponential disc with a boxy Ferrers bar
+
+    in the plane of the galaxy, the surface density is
+
+        exp(-R/disc_scale) + bar_amplitude*(1 - m^2)^ferrers_n   (m < 1)
+
+    with m = R/r_bar(theta) and r_bar the generalised ellipse of
+    Ellipse.free_ellipse (semi-axes bar_length and bar_axis_ratio*bar_length,
+    exponent bar_c: 2 is an ellipse, larger is boxier). the central disc
+    surface density is 1.
+
+    the disc is thin and transparent: at an inclination i, the galaxy y axis
+    is foreshortened by cos(i) and the surface density grows by 1/cos(i).
+
+    the noise is drawn on a lattice of spacing noise_scale (in the units of
+    extent) and interpolated bilinearly onto the pixels, so it has a fixed
+    physical correlation length: images of the same galaxy at different
+    sizes, with the same seed, carry the same noise field. noise per pixel
+    (noise_scale=None) is much stronger, relative to the structure, on finer
+    grids. for exact comparisons between sizes, use noise=0.
+
+    the image is computed a block of rows at a time, so 8192x8192 images
+    need only the output array (256 MB in float32) and small temporaries.
+
+    inputs
+    ------------
+    size           : (int or 2 ints) number of pixels along x and y
+    extent         : (float) the image covers [-extent,extent] along x and y
+    disc_scale     : (float) exponential scale length of the disc
+    bar_length     : (float) semi-major axis of the bar
+    bar_axis_ratio : (float) semi-minor over semi-major axis of the bar
+    bar_c          : (float) generalised ellipse exponent of the bar (boxiness)
+    bar_pa         : (float) angle of the bar major axis from the line of nodes, in the galaxy plane, in radians
+    bar_amplitude  : (float) central surface density of the bar, relative to the disc
+    ferrers_n      : (float) Ferrers index of the bar (0 is a flat bar)
+    inclination    : (float) inclination, in radians (0 is face-on)
+    noise          : (float) Gaussian noise added to log10 of the surface density, in dex
+                     (the rms at the lattice points)
+    noise_scale    : (float or None) spacing of the noise lattice. if None, independent noise in every pixel.
+    rng            : (np.random.Generator or int, optional) source (or seed) of the noise
+    log            : (bool) return log10 of the surface density
+    dtype          : (numpy dtype) dtype of Z, e.g. np.float32 for very large images
+    chunksize      : (int) number of rows computed at a time
+
+    returns
+    ------------
+    X,Y,Z          : (2d arrays) X and Y are read-only broadcast views of the
+                     pixel coordinates (no memory); Z is the image
+    """
+
+    if not (0. <= inclination < 0.5*np.pi):
+        raise ValueError('elliptical.synthetic.barred_galaxy: inclination must be in [0,pi/2).')
+
+    nx,ny = np.broadcast_to(np.asarray(size,dtype=int),(2,))
+    xaxis = np.linspace(-extent,extent,nx)
+    yaxis = np.linspace(-extent,extent,ny)
+
+    rng = np.random.default_rng(rng)
+
+    if (noise > 0.) and (noise_scale is not None):
+        nnodes  = int(np.ceil(2.*extent/noise_scale)) + 2
+        lattice = rng.standard_normal((nnodes,nnodes))
+        xnode,xfrac = _lattice_position(xaxis,extent,noise_scale)
+
+    Z = np.empty((ny,nx),dtype=dtype)
+
+    for start in range(0,ny,chunksize):
+        rows = slice(start,min(start+chunksize,ny))
+
+        sigma = _surface_density(xaxis[np.newaxis,:],yaxis[rows,np.newaxis],disc_scale,bar_length,bar_axis_ratio,
+                                 bar_c,bar_pa,bar_amplitude,ferrers_n,inclination)
+
+        if log or (noise > 0.):
+            sigma = np.log10(sigma)
+            if (noise > 0.) and (noise_scale is None):
+                sigma += noise*rng.standard_normal(sigma.shape)
+            elif noise > 0.:
+                ynode,yfrac = _lattice_position(yaxis[rows],extent,noise_scale)
+                yfrac = yfrac[:,np.newaxis]
+                lower,upper = lattice[ynode],lattice[ynode+1]
+                sigma += noise*((1.-yfrac)*((1.-xfrac)*lower[:,xnode] + xfrac*lower[:,xnode+1])
+                                + yfrac*((1.-xfrac)*upper[:,xnode] + xfrac*upper[:,xnode+1]))
+            if not log:
+                sigma = 10.**sigma
+
+        Z[rows] = sigma
+
+    X = np.broadcast_to(xaxis[np.newaxis,:],(ny,nx))
+    Y = np.broadcast_to(yaxis[:,np.newaxis],(ny,nx))
+
+    return X,Y,Z
+
+
+def barred_galaxy_stack(nsnapshots,pattern_speed=0.1,bar_pa=0.,**kwargs):
+    """snapshots of barred_galaxy with the bar rotating at a fixed rate
+
+    inputs
+    ------------
+    nsnapshots     : (int) the number of snapshots
+    pattern_speed  : (float) the change of the bar angle between snapshots, in radians
+    bar_pa         : (float) the bar angle of the first snapshot, in radians
+    **kwargs       : passed to barred_galaxy (a seeded rng gives different noise in each snapshot)
+
+    returns
+    ------------
+    X,Y            : (2d arrays) the pixel coordinates, as barred_galaxy
+    Zs             : (3d array) (nsnapshots,ny,nx) the images
+    angles         : (1d array) the bar angle of each snapshot
+    """
+
+    angles = bar_pa + pattern_speed*np.arange(nsnapshots)
+    kwargs['rng'] = np.random.default_rng(kwargs.get('rng'))
+
+    Zs = None
+    for k,angle in enumerate(angles):
+        X,Y,Z = barred_galaxy(bar_pa=angle,**kwargs)
+        if Zs is None:
+            Zs = np.empty((nsnapshots,)+Z.shape,dtype=Z.dtype)
+        Zs[k] = Z
+
+    return X,Y,Zs,angles
+
+
+def _surface_density(x,y,disc_scale,bar_length,bar_axis_ratio,bar_c,bar_pa,bar_amplitude,ferrers_n,inclination):
+    """the projected surface density at sky positions x,y (broadcast together)"""
+
+    # deproject onto the galaxy plane; the line of nodes is the x axis
+    cosi = np.cos(inclination)
+    xg,yg = x,y/cosi
+
+    R = np.hypot(xg,yg)
+    sigma = np.exp(-R/disc_scale)
+
+    # the bar, in its own frame, only where it can be non-zero: the
+    # generalised ellipse lies inside the circle through its corners
+    near = np.flatnonzero(np.broadcast_to(R < np.hypot(1.,bar_axis_ratio)*bar_length,sigma.shape))
+    xn = np.broadcast_to(xg,sigma.shape).ravel()[near]
+    yn = np.broadcast_to(yg,sigma.shape).ravel()[near]
+    Rn = R.ravel()[near]
+
+    u =  xn*np.cos(bar_pa) + yn*np.sin(bar_pa)
+    v = -xn*np.sin(bar_pa) + yn*np.cos(bar_pa)
+    rbar = Ellipse.free_ellipse(np.arctan2(v,u),bar_length,bar_axis_ratio*bar_length,bar_c)
+
+    m2 = (Rn/rbar)**2
+    sigma.ravel()[near] += bar_amplitude*np.where(m2 < 1.,np.abs(1.-m2),0.)**ferrers_n
+
+    return sigma/cosi
+
+
+def _lattice_position(axis,extent,spacing):
+    """the lower noise lattice node and the fractional position past it, for each coordinate"""
+
+    position = (axis + extent)/spacing
+    node = np.floor(position).astype(int)
+    return node,position - node
@@ -0,0 +1,137 @@
+"""table
+
+columnar storage for sets of ellipses
+
+EllipseTable :
+  the ellipse parameters as one structured array, with the curves
+  generated on demand instead of stored
+
+
+"""
+
+from collections.abc import Mapping
+
+import numpy as np
+
+
+class EllipseTable(Mapping):
+    '''a set of ellipses, stored by column
+
+    fields (as in the map_ellipses dictionary):
+    a  : semi-major axis
+    b  : semi-minor axis
+    e  : ellipticity, 1-b/a
+    p  : position angle
+    l  : contour level
+    xc : x centre
+    yc : y centre
+
+    the table is also a read-only mapping from ellipse number to the
+    dictionary map_ellipses has always returned, so existing code using
+    M.keys() and M[k]['x'] keeps working. those dictionaries are built on
+    access, with the x,y curves sampled at dth: changing them does not
+    change the table.
+
+    '''
+
+    fields = ('a','b','e','p','l','xc','yc')
+
+    def __init__(self,a,b,p,l,xc,yc,e=None,dth=0.01):
+        """
+        inputs
+        ------------
+        a,b,p,l,xc,yc : (1d arrays) the columns, see the class notes
+        e             : (1d array, optional) the ellipticity. computed from a and b if None.
+        dth           : (float) default angular step of the generated curves
+
+        """
+
+        a = np.asarray(a,dtype=float)
+
+        self.data = np.zeros(len(a),dtype=[(field,float) for field in EllipseTable.fields])
+        self.data['a']  = a
+        self.data['b']  = b
+        self.data['e']  = (1.-self.data['b']/a) if e is None else e
+        self.data['p']  = p
+        self.data['l']  = l
+        self.data['xc'] = xc
+        self.data['yc'] = yc
+
+        self.dth = dth
+
+    @classmethod
+    def from_dict(cls,M):
+        """build a table from a map_ellipses dictionary"""
+
+        keys = list(M.keys())
+        columns = dict()
+        for field in EllipseTable.fields:
+            columns[field] = np.array([M[k][field] for k in keys],dtype=float)
+
+        return cls(**columns)
+
+    def __getattr__(self,name):
+        # columns by name, e.g. table.a
+        if name in EllipseTable.fields:
+            return self.data[name]
+        raise AttributeError(name)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        return iter(range(len(self.data)))
+
+    def __contains__(self,k):
+        # the keys are the ellipse numbers 0...N-1, as in the dictionary
+        return isinstance(k,(int,np.integer)) and (0 <= k < len(self.data))
+
+    def __getitem__(self,k):
+        if k not in self:
+            raise KeyError(k)
+
+        x,y = self.curve(k)
+
+        ellipse = dict()
+        ellipse['x'] = x
+        ellipse['y'] = y
+        for field in EllipseTable.fields:
+            ellipse[field] = self.data[field][k]
+
+        return ellipse
+
+    def curve(self,k=None,dth=None,nth=None):
+        """generate the x,y points of ellipse k (or of all ellipses)
+
+        inputs
+        ------------
+        k          : (int, optional) the ellipse. if None, all ellipses.
+        dth        : (float, optional) angular step, defaults to the table's dth
+        nth        : (int, optional) number of points, overrides dth
+
+        returns
+        ------------
+        x,y        : (1d arrays, or (N,nth) arrays if k is None) the curve
+        """
+
+        if nth is not None:
+            th = np.linspace(0.,2*np.pi,nth,endpoint=False)
+        else:
+            th = np.arange(0,2*np.pi,self.dth if dth is None else dth)
+
+        rows = self.data if k is None else self.data[k:k+1]
+
+        a,b,phi  = rows['a'][:,np.newaxis],rows['b'][:,np.newaxis],rows['p'][:,np.newaxis]
+        xcenter  = rows['xc'][:,np.newaxis]
+        ycenter  = rows['yc'][:,np.newaxis]
+
+        xx = xcenter + a*np.cos(th)*np.cos(phi) - b*np.sin(th)*np.sin(phi)
+        yy = ycenter + a*np.cos(th)*np.sin(phi) + b*np.sin(th)*np.cos(phi)
+
+        if k is None:
+            return xx,yy
+        return xx[0],yy[0]
+
+    def to_dict(self):
+        """the map_ellipses dictionary of dictionaries, curves included"""
+        return dict([(k,self[k]) for k in self])
@@ -0,0 +1,57 @@
+"""
+this file checks adaptive level selection in map_ellipses against dense, evenly spaced levels
+
+-the bundled test image and synthetic bars are mapped with a dense numZ, and adaptively from a coarse start
+-the bar lengths of every criterion are printed side by side, with the levels traced and the time taken
+-a small maxlevels still stops the search, and a maxlevels below numZ is refused
+-de and dphi reach the search: thresholds no change can pass (de=10, dphi=360) switch off the
+ fastest-change refinement, and fewer levels are traced
+
+"""
+import time
+import pkg_resources
+
+# bring in the package itself: check all bugs
+import elliptical
+print('elliptical version {}'.format(elliptical.__version__))
+
+from elliptical.imagefile import load_dat
+from elliptical.synthetic import barred_galaxy
+from elliptical.trace import map_ellipses, MapStats
+from elliptical.measure import measureEllipse
+
+# identify the testing files
+g1 = pkg_resources.resource_filename('elliptical','data/galaxy2.dat')
+Z,grid = load_dat(g1)
+
+images = [('galaxy2',None,None,Z,grid,-6.5,-4.)]
+for bar_pa in [0.,0.6]:
+    X,Y,Zsyn = barred_galaxy(512,bar_pa=bar_pa,noise=0.01,rng=1)
+    images.append(('synthetic pa={:3.1f}'.format(bar_pa),X,Y,Zsyn,None,-2.,0.4))
+
+criteria = ['maxellip','pachange','localellipmin','ellipchange','ellipdroplimit']
+
+for name,X,Y,Z,grid,minZ,maxZ in images:
+
+    print(name)
+    runs = [('dense numZ=256',dict(numZ=256)),
+            ('adaptive numZ=16',dict(numZ=16,adaptive=True)),
+            ('adaptive numZ=16, maxlevels=24',dict(numZ=16,adaptive=True,maxlevels=24)),
+            ('adaptive numZ=16, de=10, dphi=360',dict(numZ=16,adaptive=True,de=10.,dphi=360.))]
+
+    for label,kwargs in runs:
+        stats = MapStats()
+        t0 = time.time()
+        M  = map_ellipses(X,Y,Z,minZ,maxZ,grid=grid,stats=stats,**kwargs)
+        elapsed = time.time()-t0
+        ME = measureEllipse(M)
+        print('  {0:38s} | {1:3d} levels traced, {2:3d} kept | {3} | {4:6.3f}s'.format(
+              label,stats.counts['levels'],len(M),' '.join('{} {:6.3f}'.format(c,getattr(ME,c)) for c in criteria),elapsed))
+
+
+# maxlevels must leave room for the starting levels
+try:
+    map_ellipses(X,Y,Z,-2.,0.4,numZ=64,adaptive=True,maxlevels=32)
+    print('maxlevels < numZ: accepted (wrong)')
+except ValueError as error:
+    print('maxlevels < numZ: {}'.format(error))
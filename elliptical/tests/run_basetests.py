@@ -15,7 +15,8 @@ from elliptical.trace import map_ellipses
 
 from elliptical.measure import measureEllipse
 
-from elliptical.ellipse import inside_ellipse
+from elliptical.ellipse import ellipse_mask
+from elliptical.grid import ImageGrid
 
 # identify the testing files
 g1 = pkg_resources.resource_filename('elliptical','data/galaxy2.dat')
@@ -53,7 +54,8 @@ plt.plot(MB['x'],MB['y'],color='white',linestyle='dashed',lw=1.)
 print(MB['p'])
 print(MB['a'],MB['b'])
 
-mask = inside_ellipse(MB['a'],MB['b'],MB['p'],MB['xc'],MB['yc'],X,Y)
+# xc is the centre along X (the columns) and yc along Y (the rows), as inside_ellipse took them with X,Y
+mask = ellipse_mask(MB['a'],MB['b'],MB['p'],MB['xc'],MB['yc'],ImageGrid.from_xy(X,Y))
 #plt.contourf(X,Y,Z*mask,24,cmap=cm.inferno)
 
 
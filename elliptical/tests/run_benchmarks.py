@@ -0,0 +1,191 @@
+"""
+this file benchmarks every stage of the pipeline, and stores the results as JSON
+
+-each stage is timed over a range of image sizes, contour lengths and numZ
+-the images are synthetic barred galaxies, so no data files are needed
+-the peak memory of each case is measured in a separate run, with tracemalloc
+-results can be compared against a previous run, to find regressions between commits
+
+usage:
+python run_benchmarks.py [--quick] [--repeat N] [--output results.json] [--compare old.json]
+
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+import tracemalloc
+import numpy as np
+
+# bring in the package itself: check all bugs
+import elliptical
+print('elliptical version {}'.format(elliptical.__version__))
+
+from elliptical.ellipse import SOEllipse, inside_ellipse
+from elliptical.grid import ImageGrid
+from elliptical.synthetic import barred_galaxy
+from elliptical.trace import follow_contour, make_ellipse_conic, map_ellipses
+from elliptical.measure import measureEllipse
+from elliptical.deproject import Deproject, deproject
+
+
+parser = argparse.ArgumentParser(description='benchmark the elliptical pipeline')
+parser.add_argument('--quick',action='store_true',help='small sizes only')
+parser.add_argument('--repeat',type=int,default=5,help='timings per case (the best and median are kept)')
+parser.add_argument('--output',default=None,help='JSON file for the results (default: benchmarks-<commit>.json)')
+parser.add_argument('--compare',default=None,help='a previous results file to compare against')
+parser.add_argument('--threshold',type=float,default=1.2,help='slowdown ratio reported as a regression')
+args = parser.parse_args()
+
+
+def git_commit():
+    """the commit of the package being benchmarked, if it is a git checkout"""
+    try:
+        here = os.path.dirname(os.path.abspath(elliptical.__file__))
+        return subprocess.check_output(['git','rev-parse','--short','HEAD'],cwd=here,stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def benchmark(stage,params,func,repeat,mintime=0.05,info=None):
+    """time func() repeat times, then measure its peak memory once
+
+    fast calls are looped (as timeit.autorange does) until one timing
+    takes at least mintime, and the time per call is kept.
+
+    info(output) describes what the call produced (e.g. the levels kept);
+    it is stored and printed, but is not part of the comparison key.
+    """
+
+    output = func() # warm up (imports, caches)
+
+    number = 1
+    while True:
+        t0 = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter()-t0
+        if elapsed >= mintime:
+            break
+        number *= 2
+
+    times = [elapsed/number]
+    for _ in range(repeat-1):
+        t0 = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter()-t0)/number)
+
+    tracemalloc.start()
+    func()
+    _,peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {'stage':stage,'params':params,'best':min(times),'median':float(np.median(times)),'repeat':repeat,'number':number,'peak_memory':peak,
+              'info':{} if info is None else info(output)}
+    print('{0:24s} {1:40s} | best {2:9.5f}s | median {3:9.5f}s | peak {4:9.2f} MB{5}'.format(
+          stage,json.dumps(params),result['best'],result['median'],peak/2.**20,
+          ''.join(' | {} {}'.format(key,value) for key,value in result['info'].items())))
+    return result
+
+
+def noisy_ellipse(npoints,rng):
+    th = np.linspace(0.,2*np.pi,npoints,endpoint=False)
+    x = 2.*np.cos(th)*np.cos(0.3) - 0.8*np.sin(th)*np.sin(0.3) + 0.01*rng.normal(size=npoints)
+    y = 2.*np.cos(th)*np.sin(0.3) + 0.8*np.sin(th)*np.cos(0.3) + 0.01*rng.normal(size=npoints)
+    return x,y
+
+
+sizes     = [256,512] if args.quick else [256,512,1024,2048]
+npoints   = [100,1000] if args.quick else [100,1000,10000,100000]
+numZs     = [16,64] if args.quick else [16,64,256]
+minZ,maxZ = -2.,0.4
+
+# synthetic barred galaxies: the same galaxy, and the same noise field (its correlation
+# length is physical, see elliptical.synthetic), at every size
+images = dict()
+for size in sizes:
+    X,Y,Z = barred_galaxy(size,bar_pa=0.6,noise=0.01,rng=1)
+    images[size] = (X,Y,Z,ImageGrid.from_xy(X,Y))
+
+rng = np.random.default_rng(42)
+results = []
+
+
+# fitting single contours
+for n in npoints:
+    x,y = noisy_ellipse(n,rng)
+    results.append(benchmark('SOEllipse.fitEllipse',{'npoints':n},lambda: SOEllipse.fitEllipse(x,y),args.repeat))
+    results.append(benchmark('make_ellipse_conic',{'npoints':n},lambda: make_ellipse_conic(x,y),args.repeat))
+
+# tracing one contour: an isophote of the bar, chosen from the image
+for size in sizes:
+    X,Y,Z,grid = images[size]
+    level = np.quantile(Z,0.98)
+    results.append(benchmark('follow_contour',{'size':size},lambda: follow_contour(X,Y,Z,level),args.repeat,
+                             info=lambda con: {'points':len(con[0])}))
+
+# the full map, all levels and the best-fit ellipse only
+for size in sizes:
+    X,Y,Z,grid = images[size]
+    for numZ in numZs:
+        results.append(benchmark('map_ellipses',{'size':size,'numZ':numZ},lambda: map_ellipses(X,Y,Z,minZ,maxZ,numZ=numZ),args.repeat,
+                                 info=lambda M: {'kept':len(M)}))
+        results.append(benchmark('map_ellipses(optimal)',{'size':size,'numZ':numZ},lambda: map_ellipses(X,Y,Z,minZ,maxZ,numZ=numZ,optimal=True),args.repeat,
+                                 info=lambda best: {'a':None if best is None else round(float(best['a']),4)}))
+
+# measuring a map
+X,Y,Z,grid = images[sizes[0]]
+for numZ in numZs:
+    M = map_ellipses(X,Y,Z,minZ,maxZ,numZ=numZ)
+    results.append(benchmark('measureEllipse',{'numZ':numZ,'nlevels':len(M)},lambda: measureEllipse(M).pachange,args.repeat,
+                             info=lambda length: {'pachange':round(float(length),4)}))
+
+# which pixels are inside an ellipse
+for size in sizes:
+    X,Y,Z,grid = images[size]
+    results.append(benchmark('inside_ellipse',{'size':size},lambda: inside_ellipse(2.,0.8,0.3,0.,0.,X,Y),args.repeat))
+
+# deprojection, one ellipse at a time and in bulk
+results.append(benchmark('Deproject',{'n':1},lambda: Deproject(2.,1.,0.4,0.6),args.repeat))
+for n in npoints:
+    a,b = 1.+rng.random(n),rng.random(n)
+    results.append(benchmark('deproject',{'n':n},lambda: deproject(a,b,0.4,0.6),args.repeat))
+
+
+meta = {'commit':git_commit(),'version':elliptical.__version__,'time':time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python':platform.python_version(),'numpy':np.__version__,'machine':platform.machine(),'quick':args.quick}
+
+output = args.output if args.output is not None else 'benchmarks-{}.json'.format(meta['commit'] or 'local')
+with open(output,'w') as f:
+    json.dump({'meta':meta,'results':results},f,indent=1)
+print('results written to {}'.format(output))
+
+
+# compare against an earlier run: best times, matching on stage and parameters
+if args.compare is not None:
+
+    with open(args.compare) as f:
+        previous = json.load(f)
+
+    key = lambda r: (r['stage'],json.dumps(r['params'],sort_keys=True))
+    old = dict((key(r),r) for r in previous['results'])
+
+    print('\ncompared with {} (commit {})'.format(args.compare,previous['meta'].get('commit')))
+    regressions = 0
+    for r in results:
+        if key(r) not in old:
+            continue
+        ratio = r['best']/old[key(r)]['best']
+        flag = ''
+        if ratio > args.threshold:
+            flag = '  <-- slower'
+            regressions += 1
+        print('{0:24s} {1:40s} | {2:6.2f}x time | {3:6.2f}x memory{4}'.format(
+              r['stage'],json.dumps(r['params']),ratio,r['peak_memory']/max(old[key(r)]['peak_memory'],1),flag))
+
+    print('{} regressions over {:.2f}x'.format(regressions,args.threshold))
+    sys.exit(1 if regressions > 0 else 0)
@@ -3,17 +3,28 @@ this file tests some deprojection of ellipses
 
 -Interesting things happen when the ellipse is rotated in 3d, so the deprojection is not guaranteed to be unique and recover the ellipse!
 -A good characterisation would be figuring out under what circumstances the ellipses can be recovered, (i.e. the gold sample from MaNGA)
+-deproject is compared with equations A10-A11 as the Deproject class first evaluated them (s1, s2), away from their singularities
+-the singular flag must mark edge-on discs and bad axes, and nothing at the singularities of A10-A12 that deproject removes
+-deproject_montecarlo must leave singular samples out of every histogram and sum, whatever the chunk size
+-the Monte Carlo memory must not grow with the number of samples (tracemalloc peak)
+-the percentiles come from the histogram, so they are resolved to one bin: a fixed input shows the spread
+-the figure is only drawn if matplotlib is installed
 
 """
+import tracemalloc
 import numpy as np
-import pkg_resources
-import matplotlib.pyplot as plt
-import matplotlib.cm as cm
+
+try:
+    import matplotlib.pyplot as plt
+    import matplotlib.cm as cm
+except ImportError:
+    plt = None
 
 # bring in the package itself: check all bugs
 import elliptical
+print('elliptical version {}'.format(elliptical.__version__))
 
-from elliptical.deproject import Deproject
+from elliptical.deproject import Deproject, deproject, deproject_montecarlo
 from elliptical.ellipse import SOEllipse
 from elliptical.trace import make_ellipse_conic
 
@@ -53,9 +64,9 @@ xx = 2.*rc*np.cos(th)
 yy = rc*np.sin(th)
 
 
-plt.figure()
-
-plt.plot(xx,yy,color='black')
+if plt is not None:
+    plt.figure()
+    plt.plot(xx,yy,color='black')
 
 yrot = 40.
 zrot = 0.
@@ -73,9 +84,65 @@ for indx in np.linspace(5.,85.,10):
     D = Deproject(EE[0],EE[1],yrot*np.pi/180.,indx*np.pi/180.)
     print(np.round(indx,1),np.round(EE[0],2),np.round(EE[1],2),np.round(D.sma,2),np.round(D.smb,2))
 
-    plt.plot(xp,yp,color=cm.viridis(indx/90.,1.))
-
-plt.xlabel('X [scale lengths]')
-plt.ylabel('Y [scale lengths]')
-plt.tight_layout()
-plt.savefig('deproject1.png')
+    if plt is not None:
+        plt.plot(xp,yp,color=cm.viridis(indx/90.,1.))
+
+if plt is not None:
+    plt.xlabel('X [scale lengths]')
+    plt.ylabel('Y [scale lengths]')
+    plt.tight_layout()
+    plt.savefig('deproject1.png')
+
+
+# propagate uncertain viewing angles through the deprojection
+MC = deproject_montecarlo(2.,1.,(0.,5.*np.pi/180.),(np.pi/4.,5.*np.pi/180.),nsamples=1000000,rng=42)
+print('Monte Carlo: {} samples ({} singular)'.format(MC['nsamples'],MC['nsingular']))
+print('  sma percentiles (2.5,16,50,84,97.5):',np.round(MC['sma']['percentiles'],3))
+print('  ecc percentiles (2.5,16,50,84,97.5):',np.round(MC['ecc']['percentiles'],3))
+
+
+# deproject against A10-A11 as first evaluated (Deproject._s1,_s2), on a grid
+# of axes and angles that avoids their singularities (i=0 with alpha=n pi/4,
+# and the edge-on disc)
+a,b,alpha,i = [v.ravel() for v in np.meshgrid([1.,2.,5.],[0.3,0.9],np.linspace(0.05,1.5,13),np.linspace(0.05,1.4,12),indexing='ij')]
+D = Deproject(a,b,alpha,i)
+s1 = Deproject._s1(D._Aprime(),D._Bprime(),D._Cprime())
+s2 = Deproject._s2(D._Aprime(),D._Bprime(),D._Cprime())
+V = deproject(a,b,alpha,i)
+print('deproject vs A10-A11 | {} ellipses | max relative difference: sma {:.1e}, smb {:.1e}'.format(
+      len(a),np.max(np.abs(V['sma']/np.fmax(s1,s2)-1.)),np.max(np.abs(V['smb']/np.fmin(s1,s2)-1.))))
+
+# the singular cases
+cases = [('edge-on',2.,1.,0.3,np.pi/2),('zero axis',0.,1.,0.3,0.5),('negative axis',2.,-1.,0.3,0.5),('infinite axis',np.inf,1.,0.3,0.5),
+         ('face-on, alpha=pi/4',2.,1.,np.pi/4,0.),('alpha=0',2.,1.,0.,0.5),('alpha=pi/2',2.,1.,np.pi/2,0.5)]
+for name,ca,cb,calpha,ci in cases:
+    V = deproject(ca,cb,calpha,ci)
+    print('{0:20s} | singular {1!s:5s} | sma {2:.4f} smb {3:.4f} pa {4:.4f}'.format(name,V['singular'],V['sma'],V['smb'],V['pa']))
+
+# a tenth of the discs edge-on: only the inclinations are drawn, so the
+# samples are the same stream whatever the chunk size, and can be redone here
+def inclination(rng,size):
+    return np.where(rng.random(size) < 0.1,np.pi/2,np.pi/4)
+
+nsamples = 200000
+V = deproject(2.,1.,0.3,inclination(np.random.default_rng(5),nsamples))
+good = V['sma'][~V['singular']]
+for chunksize in [nsamples,30000,777]:
+    MC = deproject_montecarlo(2.,1.,0.3,inclination,nsamples=nsamples,chunksize=chunksize,smarange=(0.,4.),rng=5)
+    H  = MC['sma']
+    print('chunks of {0:6d} | {1} singular (expected {2}) | in the histogram {3} of {4} non-singular | mean {5:.6f} (expected {6:.6f}) | counts as a direct histogram: {7}'.format(
+          chunksize,MC['nsingular'],np.sum(V['singular']),np.sum(H['counts'])+H['underflow']+H['overflow'],len(good),H['mean'],np.mean(good),
+          np.array_equal(H['counts'],np.histogram(good,bins=H['edges'])[0])))
+
+# memory, against the number of samples
+for nsamples in [1000000,10000000]:
+    tracemalloc.start()
+    MC = deproject_montecarlo(2.,1.,(0.,5.*np.pi/180.),(np.pi/4.,5.*np.pi/180.),nsamples=nsamples,rng=42)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print('Monte Carlo {0:9d} samples | peak memory {1:5.1f} MB'.format(nsamples,peak/2.**20))
+
+# a fixed input: every sample deprojects to sma=2 exactly, but the percentiles
+# are interpolated within the bin that holds them
+MC = deproject_montecarlo(2.,1.,0.,0.,nsamples=1000,bins=1000,smarange=(0.,4.))
+print('fixed input, sma=2, bins of {:.4f} | percentiles {}'.format(4./1000,np.round(MC['sma']['percentiles'],4)))
@@ -0,0 +1,63 @@
+"""
+this file checks ImageGrid, and the non-uniform (interpolated) coordinate path
+
+-is_uniform on exact, rounded, drifting and logarithmic axes
+-on non-uniform axes (ascending and descending), index_to_coords must give the axis at whole indices,
+ interpolate linearly between them, and coords_to_index must invert it
+-a uniform image mapped through the non-uniform path must give the ellipses of the uniform path
+
+"""
+import numpy as np
+
+# bring in the package itself: check all bugs
+import elliptical
+print('elliptical version {}'.format(elliptical.__version__))
+
+from elliptical.grid import ImageGrid
+from elliptical.synthetic import barred_galaxy
+from elliptical.trace import map_ellipses
+
+
+# which axes count as evenly spaced
+axes = [('exact',np.linspace(-6.,6.,256)),
+        ('rounded to 3 decimals',np.round(np.linspace(-6.,6.,256),3)),
+        ('step 1.0 to 1.04',np.cumsum(np.linspace(1.,1.04,256))),
+        ('step 1.0 to 1.004',np.cumsum(np.linspace(1.,1.004,256))),
+        ('logarithmic',np.logspace(0.,1.,256)),
+        ('descending',np.linspace(6.,-6.,256)),
+        ('constant',np.zeros(256))]
+for name,axis in axes:
+    even = np.linspace(axis[0],axis[-1],len(axis))
+    step = np.abs(axis[-1]-axis[0])/(len(axis)-1)
+    print('{0:22s} | uniform: {1!s:5s} | largest offset from even spacing {2:6.3f} steps'.format(
+          name,ImageGrid.is_uniform(axis),np.max(np.abs(axis-even))/step if step > 0 else np.nan))
+
+
+# the interpolated path, on drifting axes along the rows and descending ones along the columns
+rowaxis = np.cumsum(np.linspace(1.,1.04,200))
+colaxis = np.logspace(1.,0.,300)
+grid = ImageGrid(rowaxis,colaxis)
+
+whole = np.column_stack([np.arange(200)[:,np.newaxis].repeat(300,axis=1).ravel(),np.arange(300)[np.newaxis,:].repeat(200,axis=0).ravel()])
+coords = grid.index_to_coords(whole)
+exact = np.array_equal(coords[:,0],rowaxis[whole[:,0]]) and np.array_equal(coords[:,1],colaxis[whole[:,1]])
+
+rng = np.random.default_rng(4)
+index = np.column_stack([rng.uniform(0,199,1000),rng.uniform(0,299,1000)])
+coords = grid.index_to_coords(index)
+lo = np.floor(index).astype(int)
+frac = index - lo
+linear = np.column_stack([rowaxis[lo[:,0]] + frac[:,0]*(rowaxis[lo[:,0]+1]-rowaxis[lo[:,0]]),
+                          colaxis[lo[:,1]] + frac[:,1]*(colaxis[lo[:,1]+1]-colaxis[lo[:,1]])])
+print('non-uniform grid (uniform: {}) | whole indices exact: {} | linear between: {:.1e} | round trip: {:.1e} pixels'.format(
+      grid.uniform,exact,np.max(np.abs(coords-linear)),np.max(np.abs(grid.coords_to_index(coords)-index))))
+
+
+# the same image through both paths
+X,Y,Z = barred_galaxy(256,bar_pa=0.6,noise=0.01,rng=1)
+uniform = ImageGrid.from_xy(X,Y)
+interpolated = ImageGrid.from_xy(X,Y,uniform=False)
+MU = map_ellipses(X,Y,Z,-2.,0.4,numZ=32,grid=uniform,table=True)
+MI = map_ellipses(X,Y,Z,-2.,0.4,numZ=32,grid=interpolated,table=True)
+print('uniform image, interpolated path | {} vs {} ellipses | max difference: a {:.1e}, xc {:.1e}, yc {:.1e}'.format(
+      len(MI),len(MU),np.max(np.abs(MI.a-MU.a)),np.max(np.abs(MI.xc-MU.xc)),np.max(np.abs(MI.yc-MU.yc))))
@@ -0,0 +1,66 @@
+"""
+this file checks the binary image files and the cached .dat loader
+
+-read_dat must give the values np.genfromtxt reads, with a peak memory of about twice the result
+-load_dat must keep its cache in the user cache directory, and nothing next to the text file
+-a second load must memory-map the cache, and a changed text file must rebuild it
+-an explicit cachefile puts the cache where it is asked
+
+"""
+import os
+import shutil
+import tempfile
+import tracemalloc
+import numpy as np
+import pkg_resources
+
+# bring in the package itself: check all bugs
+import elliptical
+print('elliptical version {}'.format(elliptical.__version__))
+
+from elliptical.imagefile import read_dat, load_dat, cache_directory
+
+
+g1 = pkg_resources.resource_filename('elliptical','data/galaxy2.dat')
+
+# parsing
+tracemalloc.start()
+X,Y,Z = read_dat(g1)
+peak = tracemalloc.get_traced_memory()[1]
+tracemalloc.stop()
+
+reference = np.genfromtxt(g1,skip_header=1)
+same = all(np.array_equal(A.ravel(),reference[:,k]) for k,A in enumerate([X,Y,Z]))
+print('read_dat {} | values as genfromtxt: {} | peak memory {:.1f}x the result'.format(Z.shape,same,peak/(X.nbytes+Y.nbytes+Z.nbytes)))
+
+
+with tempfile.TemporaryDirectory() as tmp:
+
+    # a copy of the text image, and a private user cache directory
+    source = os.path.join(tmp,'data','galaxy.dat')
+    os.makedirs(os.path.dirname(source))
+    shutil.copy(g1,source)
+    os.environ['XDG_CACHE_HOME'] = os.path.join(tmp,'cache')
+
+    Z1,grid = load_dat(source)
+    print('first load | cache files in the user cache directory: {} | next to the text file: {}'.format(
+          len(os.listdir(cache_directory())),sorted(os.listdir(os.path.dirname(source)))))
+
+    Z2,grid = load_dat(source)
+    print('second load | memory-mapped: {} | same image: {}'.format(isinstance(Z2,np.memmap),np.array_equal(Z1,Z)))
+
+    # change the text file: the cache must follow
+    with open(source,'r') as f:
+        lines = f.readlines()
+    x,y,z = lines[1].split()
+    lines[1] = '{} {} {}\n'.format(x,y,float(z)+1.)
+    with open(source,'w') as f:
+        f.writelines(lines)
+    Z3,grid = load_dat(source)
+    print('changed text file | first pixel {:.6f} -> {:.6f} | cache files: {}'.format(Z2.ravel()[0],Z3.ravel()[0],len(os.listdir(cache_directory()))))
+
+    # asked for next to the text file
+    Z4,grid = load_dat(source,cachefile=source + '.eimg')
+    print('explicit cachefile | next to the text file: {} | same image: {}'.format(sorted(os.listdir(os.path.dirname(source))),np.array_equal(Z4,Z3)))
+
+    del Z1,Z2,Z3,Z4
@@ -0,0 +1,55 @@
+"""
+this file checks the particle imaging front end
+
+-a particle disc with a bar is drawn and written to .npy files
+-the files are memory-mapped and imaged in chunks
+-the chunked histogram must match np.histogram2d, and the image goes straight into map_ellipses
+
+"""
+import os
+import time
+import tempfile
+import numpy as np
+
+# bring in the package itself: check all bugs
+import elliptical
+print('elliptical version {}'.format(elliptical.__version__))
+
+from elliptical.imaging import surface_density,histogram_particles
+from elliptical.trace import map_ellipses
+
+
+rng = np.random.default_rng(42)
+nparticles = 4000000
+
+# an exponential disc (scale length 0.01) and a bar along x (length 0.02, axis ratio 0.4)
+ndisc = nparticles//2
+r     = rng.gamma(2.,0.01,ndisc)
+th    = rng.uniform(0.,2*np.pi,ndisc)
+nbar  = nparticles - ndisc
+u     = rng.uniform(-1.,1.,nbar)
+v     = rng.normal(0.,1.,nbar)
+x = np.concatenate([r*np.cos(th),0.02*u*np.sqrt(np.abs(u))]).astype(np.float32)
+y = np.concatenate([r*np.sin(th),0.008*v*(1.-np.abs(u))]).astype(np.float32)
+mass = np.full(nparticles,1./nparticles,dtype=np.float32)
+
+with tempfile.TemporaryDirectory() as tmp:
+
+    for name,arr in [('x',x),('y',y),('mass',mass)]:
+        np.save(os.path.join(tmp,name+'.npy'),arr)
+
+    xm,ym,mm = [np.load(os.path.join(tmp,name+'.npy'),mmap_mode='r') for name in ['x','y','mass']]
+
+    edges = np.linspace(-0.06,0.06,129)
+    H = histogram_particles(xm,ym,mm,edges,edges,chunksize=250000)
+    H2d,_,_ = np.histogram2d(y,x,bins=[edges,edges],weights=mass)
+    print('chunked histogram matches np.histogram2d: {}'.format(np.allclose(H,H2d,rtol=1.e-10,atol=1.e-12)))
+
+    for gridsize in [128,512,2048]:
+        t0 = time.time()
+        X,Y,Z = surface_density(xm,ym,mm,extent=0.06,gridsize=gridsize,smooth=0.0005,chunksize=1000000)
+        print('{0:5d}x{0:<5d} | {1:d} particles | imaged in {2:6.3f}s'.format(gridsize,nparticles,time.time()-t0))
+
+    X,Y,Z = surface_density(xm,ym,mm,extent=0.06,gridsize=256,smooth=0.0005)
+    M = map_ellipses(X,Y,Z,np.nanpercentile(Z,40),np.nanpercentile(Z,99),numZ=32,optimal=True)
+    print('bar length (pachange): {}'.format(None if M is None else M['a']))
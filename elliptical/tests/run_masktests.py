@@ -0,0 +1,76 @@
+"""
+this file checks that ellipse masks land on the traced ellipses
+
+-the synthetic galaxy is shifted by whole pixels along the rows and columns, and mapped again
+-the fitted centres must move by the shift: xc with the columns (X), yc with the rows (Y)
+-the mask of every ellipse of a shifted map must be the mask of the centred map, shifted
+-so must the labels of the whole map (ellipse_labels)
+-on a non-square grid with unequal spacing, ellipse_mask (mask and flat indices) must equal
+ inside_ellipse evaluated on every pixel, for ellipses inside, clipped by, and entirely off the image
+
+
+"""
+import numpy as np
+
+# bring in the package itself: check all bugs
+import elliptical
+print('elliptical version {}'.format(elliptical.__version__))
+
+from elliptical.ellipse import ellipse_mask, ellipse_labels, inside_ellipse
+from elliptical.grid import ImageGrid
+from elliptical.synthetic import barred_galaxy
+from elliptical.trace import map_ellipses
+
+
+# the galaxy is faint at the edges, so rolling it only moves the galaxy
+X,Y,Z = barred_galaxy(256,bar_pa=0.6,noise=0.,rng=1)
+grid  = ImageGrid.from_xy(X,Y)
+step  = grid.spacing
+
+M0 = map_ellipses(X,Y,Z,-2.,0.4,numZ=32,table=True)
+L0 = ellipse_labels(M0,grid)
+
+for shift in [(0,0),(20,0),(0,-13),(20,-13)]:
+
+    Zs = np.roll(Z,shift,axis=(0,1))
+    M  = map_ellipses(X,Y,Zs,-2.,0.4,numZ=32,CENTERTOL=4.,table=True)
+
+    # the shift along the rows moves yc, along the columns xc
+    dxc = np.max(np.abs(M.xc - M0.xc - shift[1]*step[1]))
+    dyc = np.max(np.abs(M.yc - M0.yc - shift[0]*step[0]))
+
+    wrong = 0
+    for k in range(len(M)):
+        mask0 = ellipse_mask(M0.a[k],M0.b[k],M0.p[k],M0.xc[k],M0.yc[k],grid)
+        mask  = ellipse_mask(M.a[k],M.b[k],M.p[k],M.xc[k],M.yc[k],grid)
+        wrong += np.sum(mask != np.roll(mask0,shift,axis=(0,1)))
+
+    # the labels of the shifted map, against the shifted labels of the centred one
+    mislabelled = np.sum(ellipse_labels(M,grid) != np.roll(L0,shift,axis=(0,1)))
+
+    print('shift rows {0:3d}, columns {1:3d} | {2:2d} ellipses | centre error: xc {3:8.1e}, yc {4:8.1e} | pixels off the shifted masks: {5}, labels: {6}'.format(
+          shift[0],shift[1],len(M),dxc,dyc,wrong,mislabelled))
+
+
+# the bounding box against the full grid. inside_ellipse measures phi from the
+# axis of its first points, so it is given the row coordinates first
+boxgrid = ImageGrid.from_origin((-2.,-4.5),(0.02,0.03),(200,300))
+ROWS,COLS = np.meshgrid(boxgrid.rowaxis,boxgrid.colaxis,indexing='ij')
+
+rng = np.random.default_rng(3)
+cases = {'inside':(0.,0.),'clipped':(2.,4.5),'off the image':(6.,12.)}
+for name,(rowreach,colreach) in cases.items():
+    differ,npixels = 0,0
+    for trial in range(50):
+        sma = rng.uniform(0.1,1.5)
+        smb = sma*rng.uniform(0.2,1.)
+        phi = rng.uniform(-np.pi,np.pi)
+        # centres around the image middle, pushed out to an edge (or beyond) by reach
+        ycentre = 0. + rng.choice([-1,1])*rowreach + rng.uniform(-0.3,0.3)
+        xcentre = 0. + rng.choice([-1,1])*colreach + rng.uniform(-0.3,0.3)
+        full = inside_ellipse(sma,smb,phi,ycentre,xcentre,ROWS,COLS).astype(bool)
+        mask = ellipse_mask(sma,smb,phi,xcentre,ycentre,boxgrid)
+        flat = ellipse_mask(sma,smb,phi,xcentre,ycentre,boxgrid,flat=True)
+        differ  += (not np.array_equal(mask,full)) or (not np.array_equal(np.sort(flat),np.flatnonzero(full)))
+        npixels += np.sum(full)
+    print('ellipses {0:13s} | 50 trials, {1:6d} pixels inside | masks differing from the full grid: {2}'.format(name,npixels,differ))
@@ -0,0 +1,160 @@
+"""
+this file checks the array measureEllipse criteria against the per-criterion loops they replaced
+
+-the previous loops are kept below, verbatim, on the same (inverse isophotal order) profile
+-every criterion is compared on the maps of the bundled test images and of synthetic bars, including maps of the inner levels only
+-where a previous loop failed (an IndexError, or a printed warning), the current criterion must give NaN
+-the best ellipse of each method must be the ellipse at its criterion, or None where the criterion is NaN
+
+"""
+import io
+import contextlib
+import numpy as np
+import pkg_resources
+
+# bring in the package itself: check all bugs
+import elliptical
+print('elliptical version {}'.format(elliptical.__version__))
+
+from elliptical.imagefile import load_dat
+from elliptical.synthetic import barred_galaxy
+from elliptical.trace import map_ellipses
+from elliptical.measure import measureEllipse
+
+
+class previousMeasure(object):
+    """the per-criterion loops of the previous measureEllipse, each run on its own"""
+
+    def __init__(self,M):
+        # the profile, as the previous constructor set it up
+        self.params = dict()
+        self.sma = M.a[::-1].copy()
+        self.ecc = M.e[::-1].copy()
+        self.phi = M.p[::-1].copy()
+
+    def _ellip_drop(self,drop=0.4):
+        self.params['ellipdrop'] = drop
+        found = False
+        j = 2
+        while found==False:
+            d = self.ecc[j-1] - self.ecc[j]
+            if d > drop:
+                found = True
+            j += 1
+            if j==len(self.sma):
+                found = True
+                j=2
+        return self.sma[j-2]
+
+    def _ellip_drop_below(self,drop=0.4):
+        self.params['ell_threshold'] = drop
+        lessthan = np.where( self.ecc >= drop )[0]
+        if len(lessthan) > 0:
+            if np.max(lessthan) < 1:
+                minbin = 1
+            else:
+                minbin = np.max(lessthan)
+        else:
+            minbin = 1
+        return self.sma[minbin]
+
+    def _max_ellip_drop(self):
+        edrop = np.ediff1d(self.ecc,to_end=0.)
+        return self.sma[ np.where(np.min(edrop)==edrop)[0][0]]
+
+    def _max_ellip(self):
+        return self.sma[np.nanargmax(self.ecc)]
+
+    def _first_ellip_min(self):
+        ellip_index = np.nanargmax(self.ecc)
+        echange = np.ediff1d(self.ecc,to_end=0.)
+        while (echange[ellip_index] < 0.):
+            ellip_index += 1
+        return self.sma[ellip_index-1]
+
+    def _ellip_change(self,change=0.1):
+        self.params['el_change'] = change
+        ellip_index = np.nanargmax(self.ecc)
+        max_ellip_value = np.nanmax(self.ecc)
+        ellip_diff = 0.
+        while (ellip_diff < change):
+            ellip_index += 1
+            ellip_diff = np.abs(self.ecc[ellip_index] - max_ellip_value)
+        return self.sma[ellip_index-1]
+
+    def _pa_change(self,change=10.):
+        self.params['pa_change'] = change
+        ellip_index = np.nanargmax(self.ecc)
+        pa_value = self.phi[ellip_index]
+        pa_diff = 0.
+        while (pa_diff < change):
+            ellip_index += 1
+            if ellip_index == len(self.phi):
+                print('PA change method failed.')
+                return self.sma[ellip_index-1]
+            pa_diff = np.abs(self.phi[ellip_index] - pa_value)*180./np.pi
+        return self.sma[ellip_index-1]
+
+
+criteria = ['maxellip','pachange','localellipmin','ellipdroplimit','maxellipdrop','ellipchange','ellipdrop']
+
+maps = []
+for name in ['galaxy1','galaxy2','galaxy3']:
+    Z,grid = load_dat(pkg_resources.resource_filename('elliptical','data/{}.dat'.format(name)))
+    for numZ in [16,64,256]:
+        maps.append(('{} numZ={}'.format(name,numZ),map_ellipses(None,None,Z,-6.5,-4.,numZ=numZ,grid=grid,table=True)))
+
+    # levels inside the bar only, where some criteria are never met
+    maps.append(('{} inner levels'.format(name),map_ellipses(None,None,Z,-4.8,-4.,numZ=32,grid=grid,table=True)))
+
+for bar_c in [2.,4.]:
+    for bar_pa in [0.,0.6,1.2]:
+        X,Y,Z = barred_galaxy(256,bar_c=bar_c,bar_pa=bar_pa,noise=0.01,rng=1)
+        maps.append(('synthetic c={} pa={}'.format(bar_c,bar_pa),map_ellipses(X,Y,Z,-2.,0.4,numZ=64,table=True)))
+    maps.append(('synthetic c={} inner levels'.format(bar_c),map_ellipses(X,Y,Z,-0.3,0.4,numZ=32,table=True)))
+
+
+# the previous private method behind each criterion
+methods = {'maxellip':'_max_ellip','pachange':'_pa_change','localellipmin':'_first_ellip_min','ellipdroplimit':'_ellip_drop_below',
+           'maxellipdrop':'_max_ellip_drop','ellipchange':'_ellip_change','ellipdrop':'_ellip_drop'}
+
+disagree = 0
+for name,M in maps:
+
+    ME = measureEllipse(M)
+
+    MP = previousMeasure(M)
+
+    differ,failed = [],[]
+    for criterion in criteria:
+
+        # the previous loops print their failures, or raise
+        printed = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(printed):
+                old = getattr(MP,methods[criterion])()
+        except IndexError:
+            old = None
+
+        new = getattr(ME,criterion)
+        if (old is None) or printed.getvalue():
+            failed.append(criterion)
+            if not np.isnan(new):
+                differ.append(criterion)
+        elif old != new:
+            differ.append(criterion)
+
+    # the best ellipse of each method is the ellipse at its criterion, or None if that failed
+    for method in ['pachange','maxellip','localellipmin','ellipchange','ellipdroplimit']:
+        length = getattr(ME,method if method in ['pachange','localellipmin','ellipchange'] else 'maxellip')
+        best   = measureEllipse(M,method=method).bestellipse
+        if (best is None) != np.isnan(length) or ((best is not None) and (best['a'] != length)):
+            differ.append('best ellipse ({})'.format(method))
+
+    disagree += len(differ) > 0
+    print('{0:28s} | {1:3d} levels | {2} | previous failed: {3}'.format(
+          name,len(M),'same' if len(differ) == 0 else 'DIFFERENT: '+', '.join(differ),', '.join(failed) if failed else 'none'))
+
+print('{} of {} maps differ from the previous loops'.format(disagree,len(maps)))
+if disagree:
+    raise AssertionError('{} of {} maps differ from the previous loops'.format(disagree,len(maps)))
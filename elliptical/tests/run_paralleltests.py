@@ -0,0 +1,95 @@
+"""
+this file checks that spreading the levels over workers does not change the ellipses
+
+-map_ellipses with n_jobs=2 and n_jobs=-1 on threads, on processes, and on an existing executor, against n_jobs=1
+-process workers read the image from shared memory, or from the file of a np.memmap: both are checked
+-the arrays the workers attach to must be the arrays that were shared
+-map_ellipses_batch over a stack, given as a 3d array, a 3d np.memmap and a generator, with
+ n_jobs=2 and n_jobs=-1: every snapshot's table and every bar length must match the serial run
+
+"""
+import os
+import tempfile
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+# bring in the package itself: check all bugs
+import elliptical
+print('elliptical version {}'.format(elliptical.__version__))
+
+from elliptical.grid import ImageGrid
+from elliptical.synthetic import barred_galaxy
+from elliptical.trace import map_ellipses, map_ellipses_batch, _share_array, _attach_array
+
+
+def same(M1,M2):
+    """bit-for-bit equality of two EllipseTables"""
+    return (len(M1) == len(M2)) and (M1.data.tobytes() == M2.data.tobytes())
+
+
+def same_batch(batch1,batch2):
+    """equality of two map_ellipses_batch results: every table, and every bar length (NaN included)"""
+    Ms1,lengths1 = batch1
+    Ms2,lengths2 = batch2
+    return ((len(Ms1) == len(Ms2)) and all(same(M1,M2) for M1,M2 in zip(Ms1,Ms2)) and
+            (sorted(lengths1) == sorted(lengths2)) and all(np.array_equal(lengths1[k],lengths2[k],equal_nan=True) for k in lengths1))
+
+
+if __name__ == '__main__':
+
+    X,Y,Z = barred_galaxy(256,bar_pa=0.6,noise=0.01,rng=1)
+    grid = ImageGrid.from_xy(X,Y)
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        # the same image, as a plain array and as a memory-mapped file
+        filename = os.path.join(tmp,'image.npy')
+        np.save(filename,Z)
+        images = [('array',np.ascontiguousarray(Z)),('memmap',np.load(filename,mmap_mode='r'))]
+
+        for name,image in images:
+
+            # what the workers attach to is what was shared
+            shm,spec = _share_array(image)
+            wshm,attached = _attach_array(spec)
+            print('{0:6s} | shared as {1:6s} | attached array identical: {2}'.format(name,spec[0],np.array_equal(attached,image)))
+            del attached
+            for block in [wshm,shm]:
+                if block is not None:
+                    block.close()
+            if shm is not None:
+                shm.unlink()
+
+            serial = map_ellipses(None,None,image,-2.,0.4,numZ=32,grid=grid,table=True,n_jobs=1)
+
+            cases = [('threads n_jobs=2',dict(n_jobs=2,executor='thread')),
+                     ('threads n_jobs=-1',dict(n_jobs=-1,executor='thread')),
+                     ('processes n_jobs=2',dict(n_jobs=2,executor='process')),
+                     ('processes n_jobs=-1',dict(n_jobs=-1))]
+
+            for case,kwargs in cases:
+                M = map_ellipses(None,None,image,-2.,0.4,numZ=32,grid=grid,table=True,**kwargs)
+                print('{0:6s} | {1:22s} | {2} levels | identical to serial: {3}'.format(name,case,len(M),same(M,serial)))
+
+            with ProcessPoolExecutor(max_workers=2) as pool:
+                M = map_ellipses(None,None,image,-2.,0.4,numZ=32,grid=grid,table=True,n_jobs=2,executor=pool)
+            print('{0:6s} | {1:22s} | {2} levels | identical to serial: {3}'.format(name,'existing process pool',len(M),same(M,serial)))
+
+        del images
+
+
+        # a stack of snapshots, the bar turning from one to the next
+        stack = np.array([barred_galaxy(256,bar_pa=pa,noise=0.01,rng=n)[2] for n,pa in enumerate(np.linspace(0.,1.5,5))])
+        filename = os.path.join(tmp,'stack.npy')
+        np.save(filename,stack)
+
+        serial = map_ellipses_batch(None,None,stack,-2.,0.4,numZ=32,grid=grid,table=True)
+
+        inputs = [('3d array',lambda: stack),
+                  ('3d memmap',lambda: np.load(filename,mmap_mode='r')),
+                  ('generator',lambda: (Z for Z in stack))]
+
+        for name,make in inputs:
+            for case,kwargs in [('processes n_jobs=2',dict(n_jobs=2)),('processes n_jobs=-1',dict(n_jobs=-1)),('threads n_jobs=2',dict(n_jobs=2,executor='thread'))]:
+                batch = map_ellipses_batch(None,None,make(),-2.,0.4,numZ=32,grid=grid,table=True,**kwargs)
+                print('batch {0:9s} | {1:19s} | {2} snapshots | tables and bar lengths identical to serial: {3}'.format(name,case,len(batch[0]),same_batch(batch,serial)))
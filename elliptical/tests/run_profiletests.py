@@ -0,0 +1,78 @@
+"""
+this file checks ellipse_photometry against a mask per ellipse
+
+-boxy synthetic bars, whose traced ellipses cross near the end of the bar
+-the enclosed and annular sums are compared with ellipse_mask sums, ellipse by ellipse
+-the number of ellipses that are not nested (and so summed with their own mask) is printed
+-the same galaxy shifted by whole pixels must give the same photometry
+-the isophotes sampled along the fitted ellipses must follow the contour level, centred or shifted
+
+"""
+import time
+import numpy as np
+
+# bring in the package itself: check all bugs
+import elliptical
+print('elliptical version {}'.format(elliptical.__version__))
+
+from elliptical.ellipse import ellipse_mask
+from elliptical.grid import ImageGrid
+from elliptical.synthetic import barred_galaxy
+from elliptical.table import EllipseTable
+from elliptical.trace import map_ellipses
+from elliptical.profile import ellipse_photometry, sample_isophotes
+
+
+for bar_c in [2.,4.]:
+    for bar_pa in [0.,0.6,1.2]:
+
+        X,Y,Z = barred_galaxy(512,bar_c=bar_c,bar_pa=bar_pa,noise=0.01,rng=1)
+        grid  = ImageGrid.from_xy(X,Y)
+        light = 10.**Z
+
+        M = map_ellipses(X,Y,Z,-2.,0.4,numZ=64)
+        T = EllipseTable.from_dict(M)
+
+        t0 = time.time()
+        P = ellipse_photometry(T,light,grid)
+        tphot = time.time()-t0
+
+        # one mask per ellipse, and each annulus as the difference of two masks
+        t0 = time.time()
+        masks = [ellipse_mask(T.a[k],T.b[k],T.p[k],T.xc[k],T.yc[k],grid,flat=True) for k in range(len(T))]
+        tmask = time.time()-t0
+
+        order = np.argsort(T.a,kind='stable')
+        total = np.array([light.ravel()[index].sum() for index in masks])
+        annulus = np.array([light.ravel()[np.setdiff1d(masks[k],masks[order[n-1]]) if n > 0 else masks[k]].sum() for n,k in enumerate(order)])
+        annulus = annulus[np.argsort(order)]
+
+        print('c={0:3.1f} pa={1:3.1f} | {2:2d} ellipses, {3:2d} not nested | max error: sum {4:8.1e}, annulus {5:8.1e} | {6:6.3f}s ({7:6.3f}s with masks)'.format(
+              bar_c,bar_pa,len(T),np.sum(~P['nested']),np.max(np.abs(P['sum']/total-1.)),
+              np.max(np.abs(P['annulus_sum']-annulus)/total),tphot,tmask))
+
+
+# photometry does not depend on where the galaxy sits in the image
+for bar_c in [2.,4.]:
+
+    X,Y,Z = barred_galaxy(512,bar_c=bar_c,bar_pa=0.6,noise=0.01,rng=1)
+    grid  = ImageGrid.from_xy(X,Y)
+    P0    = ellipse_photometry(map_ellipses(X,Y,Z,-2.,0.4,numZ=64,table=True),10.**Z,grid)
+
+    for shift in [(40,0),(0,-26),(40,-26)]:
+        Zs = np.roll(Z,shift,axis=(0,1))
+        P  = ellipse_photometry(map_ellipses(X,Y,Zs,-2.,0.4,numZ=64,CENTERTOL=4.,table=True),10.**Zs,grid)
+
+        print('c={0:3.1f} shift rows {1:3d}, columns {2:3d} | max change: sum {3:8.1e}, annulus {4:8.1e} | same counts: {5}, same nesting: {6}'.format(
+              bar_c,shift[0],shift[1],np.max(np.abs(P['sum']/P0['sum']-1.)),np.max(np.abs(P['annulus_sum']-P0['annulus_sum'])/P0['sum']),
+              np.array_equal(P['count'],P0['count']) and np.array_equal(P['annulus_count'],P0['annulus_count']),np.array_equal(P['nested'],P0['nested'])))
+
+
+# sampling along the ellipses: the residual from the level must not grow off-centre
+X,Y,Z = barred_galaxy(512,bar_pa=0.6,noise=0.,rng=1)
+grid  = ImageGrid.from_xy(X,Y)
+for shift in [(0,0),(40,0),(0,-26),(40,-26)]:
+    Zs = np.roll(Z,shift,axis=(0,1))
+    S  = sample_isophotes(map_ellipses(X,Y,Zs,-2.,0.4,numZ=64,CENTERTOL=4.,table=True),Zs,grid)
+    print('isophotes, shift rows {0:3d}, columns {1:3d} | rms of Z - l: median {2:8.1e}, max {3:8.1e}'.format(
+          shift[0],shift[1],np.nanmedian(S['rms']),np.nanmax(S['rms'])))
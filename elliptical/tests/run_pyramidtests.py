@@ -0,0 +1,94 @@
+"""
+this file checks the coarse-to-fine (pyramid) tracing in map_ellipses
+
+-accuracy: on the bundled test image, every level traced through the pyramid is
+ compared with the full-resolution trace, and the bar lengths are compared
+-robustness: levels that cross none of the given cells, and noisy images with NaN pixels
+-speed: the test image is resampled onto larger grids, and both modes are timed
+
+"""
+import time
+import numpy as np
+import pkg_resources
+
+# bring in the package itself: check all bugs
+import elliptical
+print('elliptical version {}'.format(elliptical.__version__))
+
+from elliptical.grid import ImageGrid
+from elliptical.imagefile import load_dat
+from elliptical.trace import map_ellipses
+from elliptical.measure import measureEllipse
+from elliptical.contour import find_contours_cells
+from elliptical.synthetic import barred_galaxy
+
+# identify the testing files
+g1 = pkg_resources.resource_filename('elliptical','data/galaxy2.dat')
+
+# unpack a test image (parsed once, then memory-mapped from the binary cache)
+Z,grid = load_dat(g1)
+xdim,ydim = Z.shape
+
+
+# accuracy on the test image
+MF = map_ellipses(None,None,Z,-6.5,-4.,numZ=64,grid=grid,table=True)
+
+for factor in [2,4]:
+    MP = map_ellipses(None,None,Z,-6.5,-4.,numZ=64,grid=grid,table=True,pyramid=factor)
+
+    common = np.intersect1d(MF.l,MP.l)
+    da = np.abs(MF.a[np.searchsorted(MF.l,common)] - MP.a[np.searchsorted(MP.l,common)])
+
+    print('factor {0} | {1} of {2} levels kept | {3} identical | max |da| {4:.4f} | pachange {5:.4f} (full {6:.4f})'.format(
+          factor,len(MP),len(MF),np.sum(da < 1.e-10),np.max(da),measureEllipse(MP).pachange,measureEllipse(MF).pachange))
+
+
+# a level that crosses none of the cells gives no contours
+ZR = np.arange(16.).reshape(4,4)
+print('no crossing: {} contours, no cells: {} contours'.format(len(find_contours_cells(ZR,100.,np.arange(9))),len(find_contours_cells(ZR,5.,[]))))
+
+
+# noisy images, with and without NaN pixels: faint levels may vanish on the coarse image
+rng = np.random.default_rng(7)
+for trial in range(8):
+    XN,YN,ZN = barred_galaxy(int(rng.integers(128,384)),bar_pa=rng.uniform(0.,np.pi),noise=rng.uniform(0.02,0.2),rng=trial)
+    if trial % 2:
+        ZN[rng.random(ZN.shape) < 0.01] = np.nan
+    full = len(map_ellipses(XN,YN,ZN,-2.5,0.4,numZ=32))
+    kept = [len(map_ellipses(XN,YN,ZN,-2.5,0.4,numZ=32,pyramid=factor)) for factor in [2,3,4]]
+    print('noisy image {0} ({1}x{1}, NaN pixels: {2}) | levels kept: full {3}, factor 2,3,4 {4}'.format(trial,ZN.shape[0],bool(trial % 2),full,kept))
+
+
+# speed on larger images: resample the test image linearly onto finer grids
+def resample(Z,size):
+    rows = np.linspace(0,Z.shape[0]-1,size)
+    cols = np.linspace(0,Z.shape[1]-1,size)
+    ZR = np.array([np.interp(rows,np.arange(Z.shape[0]),Z[:,j]) for j in range(Z.shape[1])]).T
+    return np.array([np.interp(cols,np.arange(Z.shape[1]),row) for row in ZR])
+
+# the coarse image is kept at 256x256, so each doubling of the size quadruples
+# the area but only doubles the contour length: the full traces should take
+# about 4x longer per doubling, the pyramid about 2x
+timings = {}
+for size in [1024,2048,4096]:
+
+    ZZ = resample(Z,size)
+    bigrid = ImageGrid.from_origin(grid.origin,grid.spacing*(xdim-1)/(size-1),ZZ.shape)
+    factor = size//256
+
+    for mode,kwargs in [('roi',dict(roi=True)),('sweep',dict(engine='sweep')),('pyramid',dict(pyramid=factor))]:
+        t0 = time.time()
+        M = map_ellipses(None,None,ZZ,-6.5,-4.,numZ=64,grid=bigrid,table=True,**kwargs)
+        timings[mode,size] = time.time()-t0
+        if mode == 'sweep':
+            MF = M
+
+    common = np.intersect1d(MF.l,M.l)
+    da = np.abs(MF.a[np.searchsorted(MF.l,common)] - M.a[np.searchsorted(M.l,common)])
+
+    print('{0:5d}x{0:<5d} | roi {1:6.3f}s | sweep {2:6.3f}s | pyramid x{3:<2d} {4:6.3f}s | speedup {5:4.1f} | {6} of {7} levels, max |da| {8:.2e}'.format(
+          size,timings['roi',size],timings['sweep',size],factor,timings['pyramid',size],
+          min(timings['roi',size],timings['sweep',size])/timings['pyramid',size],len(M),len(MF),np.max(da)))
+
+for mode in ['roi','sweep','pyramid']:
+    print('{0:8s} time per doubling of the size: {1}'.format(mode,' '.join('{:4.1f}x'.format(timings[mode,2*size]/timings[mode,size]) for size in [1024,2048])))
@@ -0,0 +1,48 @@
+"""
+this file benchmarks region-of-interest cropping in map_ellipses
+
+-the test galaxy is placed in the centre of ever-larger fields of faint background
+-the cropped and full-image runs must find the same ellipses
+
+"""
+import time
+import numpy as np
+import pkg_resources
+
+# bring in the package itself: check all bugs
+import elliptical
+print('elliptical version {}'.format(elliptical.__version__))
+
+from elliptical.grid import ImageGrid
+from elliptical.imagefile import load_dat
+from elliptical.trace import map_ellipses
+
+# identify the testing files
+g1 = pkg_resources.resource_filename('elliptical','data/galaxy2.dat')
+
+# unpack a test image (parsed once, then memory-mapped from the binary cache)
+Z,grid = load_dat(g1)
+xdim,ydim = Z.shape
+rng = np.random.default_rng(42)
+
+for size in [256,512,1024,2048]:
+
+    # embed the galaxy in a field of faint noise, on the same pixel scale
+    pad = (size - xdim)//2
+    ZZ = np.nanmin(Z) - 1. + 0.1*rng.random((size,size))
+    ZZ[pad:pad+xdim,pad:pad+ydim] = Z
+
+    bigrid = ImageGrid.from_origin(grid.origin - pad*grid.spacing,grid.spacing,ZZ.shape)
+
+    t0 = time.time()
+    MF = map_ellipses(None,None,ZZ,-6.5,-4.,numZ=64,grid=bigrid)
+    tfull = time.time()-t0
+
+    t0 = time.time()
+    MR = map_ellipses(None,None,ZZ,-6.5,-4.,numZ=64,grid=bigrid,roi=True)
+    troi = time.time()-t0
+
+    same = (MF.keys()==MR.keys()) and all(np.allclose(MF[k]['x'],MR[k]['x'],rtol=0.,atol=1.e-10) for k in MF.keys())
+
+    print('{0:5d}x{0:<5d} | full {1:7.3f}s | roi {2:7.3f}s | speedup {3:6.1f} | {4} levels | identical: {5}'.format(
+          size,tfull,troi,tfull/troi,len(MR),same))
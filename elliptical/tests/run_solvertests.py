@@ -0,0 +1,93 @@
+"""
+this file benchmarks the two conic solvers on the test galaxy image
+
+-'eig' is the original 6x6 eigenproblem, 'direct' the reduced 3x3 form
+-counts the levels where each solver fails, goes complex, or returns a conic that is not an
+ ellipse (the direct solver returns NaN instead), and times both
+-points exactly on an ellipse, at several scales, must be recovered by both
+
+"""
+import time
+import numpy as np
+import pkg_resources
+
+# bring in the package itself: check all bugs
+import elliptical
+print('elliptical version {}'.format(elliptical.__version__))
+
+from elliptical.ellipse import SOEllipse
+from elliptical.trace import follow_contour, make_ellipses_conic, map_ellipses
+
+# identify the testing files
+g1 = pkg_resources.resource_filename('elliptical','data/galaxy2.dat')
+
+# unpack a test image
+nmodel1 = np.genfromtxt(g1,max_rows=1)
+xdim,ydim = int(nmodel1[0]),int(nmodel1[1])
+
+model1 = np.genfromtxt(g1,skip_header=1)
+X,Y,Z = model1[:,0].reshape([xdim,ydim]),model1[:,1].reshape([xdim,ydim]),model1[:,2].reshape([xdim,ydim])
+
+# trace contours over the full dynamic range of the image, including the
+# faint, noisy levels that produce degenerate contours
+levels = np.linspace(np.nanmin(Z),np.nanmax(Z),256)[1:-1]
+contours = [follow_contour(X,Y,Z,cval) for cval in levels]
+XCONS = [c[1] for c in contours]
+YCONS = [c[0] for c in contours]
+
+
+def count_single(solver):
+    """fit one contour at a time, as map_ellipses used to"""
+    failed,complexfit,notellipse = 0,0,0
+    for x,y in zip(XCONS,YCONS):
+        try:
+            ell = SOEllipse.fitEllipse(x,y,solver=solver)
+        except Exception:
+            failed += 1
+            continue
+        if not np.all(np.isfinite(ell)):
+            failed += 1
+        elif np.any(np.iscomplex(ell)):
+            complexfit += 1
+        elif 4*ell[0].real*ell[2].real - ell[1].real**2 <= 0:
+            notellipse += 1
+    return failed,complexfit,notellipse
+
+
+ntrials = 10
+for solver in ['eig','direct']:
+
+    t0 = time.time()
+    for n in range(ntrials):
+        failed,complexfit,singlenotellipse = count_single(solver)
+    tsingle = (time.time()-t0)/ntrials
+
+    t0 = time.time()
+    for n in range(ntrials):
+        a,b,phi,xc,yc = make_ellipses_conic(XCONS,YCONS,solver=solver)
+    tbatch = (time.time()-t0)/ntrials
+
+    # the ellipse condition on the coefficients: 4ac - b^2 > 0
+    ell = SOEllipse.fitEllipses(XCONS,YCONS,solver=solver)
+    fitted = np.all(np.isfinite(ell),axis=1)
+    notellipse = np.sum(4*ell[fitted,0]*ell[fitted,2] - ell[fitted,1]**2 <= 0)
+
+    t0 = time.time()
+    M = map_ellipses(X,Y,Z,-6.5,-4.,numZ=64,solver=solver)
+    tmap = time.time()-t0
+
+    print('{0:6s} | single {1:7.4f}s (failed={2}, complex={3}, not ellipse={4}) | batch {5:7.4f}s (not ellipse={6}) | map_ellipses {7:6.3f}s, {8} levels kept'.format(
+          solver,tsingle,failed,complexfit,singlenotellipse,tbatch,notellipse,tmap,len(M)))
+
+
+# points exactly on an ellipse (the scatter matrix is then singular), at very
+# different scales and away from the origin: both solvers must recover it
+th = np.linspace(0.,2*np.pi,200)
+for scale in [1.e-3,1.,1.e3]:
+    x = scale*(3.*np.cos(th)*np.cos(0.4) - np.sin(th)*np.sin(0.4) + 2.)
+    y = scale*(3.*np.cos(th)*np.sin(0.4) + np.sin(th)*np.cos(0.4) - 1.)
+    for solver in ['eig','direct']:
+        single = make_ellipses_conic([x],[y],solver=solver)
+        a,b,phi,xc,yc = [v[0] for v in single]
+        print('exact ellipse, scale {0:6.0e}, {1:6s} | single fit finite: {2} | a/scale {3:.6f} b/scale {4:.6f} (true 3, 1)'.format(
+              scale,solver,bool(np.all(np.isfinite(SOEllipse.fitEllipse(x,y,solver=solver)))),a/scale,b/scale))
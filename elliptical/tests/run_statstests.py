@@ -0,0 +1,63 @@
+"""
+this file checks the MapStats counters of map_ellipses
+
+-passing stats must not change the result, for every way of tracing the levels
+-every level must be accounted for once: kept, rejected, or failed by cause
+-the kept ellipses must be the ones returned, and the stage timings must be filled
+-one MapStats passed to several calls must add them up
+
+"""
+
+# bring in the package itself: check all bugs
+import elliptical
+print('elliptical version {}'.format(elliptical.__version__))
+
+from elliptical.synthetic import barred_galaxy
+from elliptical.trace import map_ellipses, MapStats
+
+
+def same(M1,M2):
+    """bit-for-bit equality of two EllipseTables"""
+    return (len(M1) == len(M2)) and (M1.data.tobytes() == M2.data.tobytes())
+
+
+if __name__ == '__main__':
+
+    # levels up past the peak (no contour), and noise at the faint end (short
+    # contours, rejected fits)
+    X,Y,Z = barred_galaxy(256,bar_pa=0.6,noise=0.02,rng=1)
+
+    runs = [('skimage',dict()),
+            ('sweep',dict(engine='sweep')),
+            ('roi',dict(roi=True)),
+            ('pyramid x2',dict(pyramid=2)),
+            ('threads n_jobs=2',dict(n_jobs=2,executor='thread')),
+            ('processes n_jobs=2',dict(n_jobs=2)),
+            ('adaptive',dict(adaptive=True)),
+            ('direct solver',dict(solver='direct'))]
+
+    for name,kwargs in runs:
+        plain = map_ellipses(X,Y,Z,-2.5,1.,numZ=32,table=True,**kwargs)
+        stats = MapStats()
+        M     = map_ellipses(X,Y,Z,-2.5,1.,numZ=32,table=True,stats=stats,**kwargs)
+
+        counts,failures = stats.counts,stats.failures
+        accounted = (counts['kept'] + counts['rejected_centre'] + counts['rejected_phi'] + counts['rejected_both'] + sum(failures.values()))
+        timed = all(stats.timings[stage] > 0. for stage in ['contour','fit','filter'])
+
+        print('{0:18s} | unchanged by stats: {1} | {2:2d} levels, {3:2d} kept ({4} returned), accounted for {5:2d} | no contour {6}, too few points {7}, no fit {8} | rejected {9} | stages timed: {10}'.format(
+              name,same(M,plain),counts['levels'],counts['kept'],len(M),accounted,failures['no_contour'],failures['too_few_points'],failures['fit'],
+              counts['rejected_centre']+counts['rejected_phi']+counts['rejected_both'],timed))
+
+    # the best ellipse, with the measurement timed
+    stats = MapStats()
+    best  = map_ellipses(X,Y,Z,-2.5,1.,numZ=32,optimal=True,stats=stats)
+    plain = map_ellipses(X,Y,Z,-2.5,1.,numZ=32,optimal=True)
+    print('optimal=True       | unchanged by stats: {} | measure timed: {}'.format(best['a'] == plain['a'],stats.timings['measure'] > 0.))
+
+    # one MapStats over several calls
+    stats = MapStats()
+    for numZ in [16,32,48]:
+        map_ellipses(X,Y,Z,-2.5,1.,numZ=numZ,stats=stats)
+    print('three calls        | calls {} | levels {} (16+32+48=96)'.format(stats.counts['calls'],stats.counts['levels']))
+    print(stats.report())
@@ -0,0 +1,64 @@
+"""
+this file checks ContourSweep against skimage.measure.find_contours, level by level
+
+-the bundled test image, a synthetic bar with NaN holes, and small integer images whose levels tie with pixel values
+-the assembled contours are compared with skimage.measure.find_contours point for point, as are those traced through every cell with find_contours_cells
+
+"""
+import numpy as np
+import pkg_resources
+
+# bring in the package itself: check all bugs
+import elliptical
+print('elliptical version {}'.format(elliptical.__version__))
+
+from skimage.measure import find_contours
+
+from elliptical.contour import ContourSweep, find_contours_cells
+from elliptical.imagefile import load_dat
+from elliptical.synthetic import barred_galaxy
+
+# identify the testing files
+g1 = pkg_resources.resource_filename('elliptical','data/galaxy2.dat')
+
+rng = np.random.default_rng(7)
+images = []
+
+Z,grid = load_dat(g1)
+images.append(('galaxy2',np.asarray(Z),np.linspace(-6.5,-4.,64)))
+
+# NaN pixels, scattered and in a block across the bar
+X,Y,Z = barred_galaxy(256,bar_pa=0.6,noise=0.01,rng=1)
+Z = Z.copy()
+Z[rng.random(Z.shape) < 0.01] = np.nan
+Z[100:110,120:160] = np.nan
+images.append(('synthetic with NaN',Z,np.linspace(-2.,0.4,64)))
+
+# integer images: every level ties with many pixels, and flat regions sit exactly at a level
+Z = rng.integers(0,4,(64,64)).astype(float)
+images.append(('integers 0-3',Z,np.array([0.,0.5,1.,1.5,2.,2.5,3.])))
+
+Z = np.round(4.*np.exp(-np.hypot(*np.meshgrid(np.linspace(-2,2,96),np.linspace(-2,2,80)))))
+Z[rng.random(Z.shape) < 0.02] = np.nan
+images.append(('plateaus with NaN',Z,np.array([0.,1.,2.,3.,4.])))
+
+
+for name,Z,levels in images:
+
+    sweep = ContourSweep(Z,levels)
+    ncells = (Z.shape[0]-1)*(Z.shape[1]-1)
+
+    same_contours,same_cells,npoints = 0,0,0
+    for level in levels:
+
+        expected = find_contours(Z,level)
+        npoints += sum(len(c) for c in expected)
+
+        found = sweep.find_contours(level)
+        same_contours += (len(found) == len(expected)) and all(np.array_equal(a,b) for a,b in zip(found,expected))
+
+        found = find_contours_cells(Z,level,np.arange(ncells)[::-1])
+        same_cells += (len(found) == len(expected)) and all(np.array_equal(a,b) for a,b in zip(found,expected))
+
+    print('{0:20s} | {1:3d}x{2:<3d} {3:5d} NaN | {4:2d} levels, {5:6d} points | identical: contours {6:2d}, through cells {7:2d}'.format(
+          name,Z.shape[0],Z.shape[1],int(np.sum(np.isnan(Z))),len(levels),npoints,same_contours,same_cells))
@@ -0,0 +1,54 @@
+"""
+this file checks measureEllipse against synthetic bars of known length
+
+-exponential disc plus a Ferrers bar of semi-major axis 2, for a range of boxiness and bar angles
+-the measured lengths are printed next to the true length, face-on and inclined
+-the same galaxy is measured at several image sizes, with and without noise
+-a stack of snapshots with a rotating bar is measured with map_ellipses_batch
+
+"""
+import time
+import numpy as np
+
+# bring in the package itself: check all bugs
+import elliptical
+print('elliptical version {}'.format(elliptical.__version__))
+
+from elliptical.synthetic import barred_galaxy, barred_galaxy_stack
+from elliptical.trace import map_ellipses, map_ellipses_batch
+from elliptical.measure import measureEllipse
+
+
+bar_length = 2.
+minZ,maxZ  = -2.,0.4
+
+print('true bar length {}'.format(bar_length))
+for inclination in [0.,0.7]:
+    for bar_c in [2.,2.5,4.]:
+        for bar_pa in [0.,0.6,1.2]:
+            X,Y,Z = barred_galaxy(512,bar_length=bar_length,bar_c=bar_c,bar_pa=bar_pa,inclination=inclination,noise=0.01,rng=1)
+            M = map_ellipses(X,Y,Z,minZ,maxZ,numZ=64)
+            ME = measureEllipse(M)
+            print('i={0:4.2f} c={1:3.1f} pa={2:3.1f} | {3:2d} levels | pachange {4:6.3f} | ellipdroplimit {5:6.3f} | maxellip {6:6.3f}'.format(
+                  inclination,bar_c,bar_pa,len(M),ME.pachange,ME.ellipdroplimit,ME.maxellip))
+
+
+# the same galaxy at different sizes: the noise has a fixed physical correlation
+# length, so the levels kept and the lengths should not depend on the size
+for noise in [0.,0.01]:
+    for size in [256,512,1024,2048]:
+        X,Y,Z = barred_galaxy(size,bar_length=bar_length,bar_pa=0.6,noise=noise,rng=1)
+        M = map_ellipses(X,Y,Z,minZ,maxZ,numZ=64,roi=True)
+        print('noise={0:4.2f} {1:5d}x{1:<5d} | {2:2d} levels | pachange {3:6.3f}'.format(noise,size,len(M),measureEllipse(M).pachange))
+
+
+# a rotating bar: the length should not depend on the angle
+X,Y,Zs,angles = barred_galaxy_stack(16,pattern_speed=0.2,size=256,noise=0.01,rng=2)
+Ms,lengths = map_ellipses_batch(X,Y,Zs,minZ,maxZ,numZ=64)
+print('rotating bar, pachange over {} snapshots: mean {:6.3f}, std {:6.3f}'.format(len(angles),np.nanmean(lengths['pachange']),np.nanstd(lengths['pachange'])))
+
+
+# generation speed for very large images
+t0 = time.time()
+X,Y,Z = barred_galaxy(8192,dtype=np.float32,noise=0.01,rng=3)
+print('8192x8192 float32 image generated in {:6.2f}s ({:.0f} MB)'.format(time.time()-t0,Z.nbytes/2.**20))
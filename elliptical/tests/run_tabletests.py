@@ -0,0 +1,67 @@
+"""
+this file checks EllipseTable, the columnar map_ellipses result
+
+-the columns must hold the values of the map_ellipses dictionary, ellipse by ellipse
+-to_dict and from_dict must round-trip, curves included
+-curve, for one ellipse or all of them, must give the dictionary's x,y points
+-only the ellipse numbers are keys: other keys are not in the table, and raise KeyError
+-a table must survive pickling through a process pool
+
+"""
+import pickle
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+# bring in the package itself: check all bugs
+import elliptical
+print('elliptical version {}'.format(elliptical.__version__))
+
+from elliptical.synthetic import barred_galaxy
+from elliptical.table import EllipseTable
+from elliptical.trace import map_ellipses
+
+
+def roundtrip(M):
+    """worker: send a table back as it arrived, with a sum over one of its columns"""
+    return M,np.sum(M.a)
+
+
+if __name__ == '__main__':
+
+    X,Y,Z = barred_galaxy(256,bar_pa=0.6,noise=0.01,rng=1)
+    MT = map_ellipses(X,Y,Z,-2.,0.4,numZ=32,table=True)
+    MD = map_ellipses(X,Y,Z,-2.,0.4,numZ=32)
+
+    # columnar access
+    columns = all(np.array_equal(getattr(MT,field),[MD[k][field] for k in MD]) for field in EllipseTable.fields)
+    print('{} ellipses | keys as the dictionary: {} | columns equal the dictionary values: {}'.format(len(MT),list(MT.keys()) == list(MD.keys()),columns))
+
+    # round trip through the dictionary
+    MR = EllipseTable.from_dict(MT.to_dict())
+    curves = all(np.array_equal(MT[k]['x'],MD[k]['x']) and np.array_equal(MT[k]['y'],MD[k]['y']) for k in MT)
+    print('from_dict(to_dict()) identical: {} | dictionary curves identical: {}'.format(MR.data.tobytes() == MT.data.tobytes(),curves))
+
+    # curves of one ellipse, and of all at once
+    x,y = MT.curve()
+    single = all(np.array_equal(x[k],MT.curve(k)[0]) and np.array_equal(y[k],MT.curve(k)[1]) for k in MT)
+    xn,yn = MT.curve(3,nth=64)
+    print('curve() {} | rows equal curve(k): {} | curve(3,nth=64) {} points, first at a from the centre: {}'.format(
+          x.shape,single,len(xn),np.isclose(np.hypot(xn[0]-MT.xc[3],yn[0]-MT.yc[3]),MT.a[3])))
+
+    # keys
+    contained = [(key,key in MT) for key in [0,len(MT)-1,np.int64(1),-1,len(MT),1.5,'a',None]]
+    print('in the table: {}'.format(', '.join('{!r} {}'.format(key,flag) for key,flag in contained)))
+    for key in ['a',-1,len(MT)]:
+        try:
+            MT[key]
+            print('table[{!r}]: no error'.format(key))
+        except KeyError:
+            print('table[{!r}]: KeyError'.format(key))
+    print('get with a default: {}'.format(MT.get('a','default')))
+
+    # pickling, directly and through a process pool
+    MP = pickle.loads(pickle.dumps(MT))
+    with ProcessPoolExecutor(max_workers=2) as pool:
+        MW,total = pool.submit(roundtrip,MT).result()
+    print('pickled identical: {} | through a process pool identical: {} (sum of a {} vs {})'.format(
+          MP.data.tobytes() == MT.data.tobytes() and MP.dth == MT.dth,MW.data.tobytes() == MT.data.tobytes() and MW.dth == MT.dth,total,np.sum(MT.a)))
@@ -0,0 +1,46 @@
+"""
+this file checks track_ellipses against a full map_ellipses of every snapshot
+
+-a stack of synthetic snapshots with a rotating (and, in the second stack, growing) bar
+-the tracked best-fit ellipse is compared with measureEllipse on the full map, snapshot by snapshot
+-the number of levels traced, and of full searches, is printed against the numZ per snapshot of the full maps
+-levels that stop short of the bar centre put the maximum ellipticity on the last level, which must not force a full search
+
+"""
+import time
+import numpy as np
+
+# bring in the package itself: check all bugs
+import elliptical
+print('elliptical version {}'.format(elliptical.__version__))
+
+from elliptical.synthetic import barred_galaxy, barred_galaxy_stack
+from elliptical.trace import map_ellipses, track_ellipses
+
+
+numZ = 64
+
+# a rotating bar; then a bar that also grows; then levels that stop short of the bar centre
+X,Y,Zs,angles = barred_galaxy_stack(16,pattern_speed=0.2,size=256,noise=0.01,rng=2)
+cases = [('rotating',Zs,-2.,0.4)]
+
+Zs = np.array([barred_galaxy(256,bar_length=length,bar_pa=angle,noise=0.01,rng=3)[2] for length,angle in zip(np.linspace(1.6,2.4,16),angles)])
+cases.append(('growing',Zs,-2.,0.4))
+cases.append(('cut levels',Zs,-2.,-0.3))
+
+for name,Zs,minZ,maxZ in cases:
+
+    t0 = time.time()
+    full = [map_ellipses(X,Y,Z,minZ,maxZ,numZ=numZ,optimal=True,roi=True) for Z in Zs]
+    tfull = time.time()-t0
+
+    t0 = time.time()
+    Ms,series = track_ellipses(X,Y,Zs,minZ,maxZ,numZ=numZ)
+    ttrack = time.time()-t0
+
+    afull = np.array([np.nan if best is None else best['a'] for best in full])
+    same  = np.sum(np.isclose(series['a'],afull,rtol=1.e-10,atol=0.) | (np.isnan(series['a']) & np.isnan(afull)))
+
+    print('{0:10s} | {1:2d}/{2:2d} snapshots agree, max |da| {3:7.4f} | traced {4:4d} levels (full maps {5:4d}), {6:2d} full searches | {7:6.3f}s (full maps {8:6.3f}s)'.format(
+          name,same,len(Zs),np.nanmax(np.abs(series['a']-afull)),int(np.sum(series['ntraced'])),numZ*len(Zs),
+          int(np.sum(series['widened'])),ttrack,tfull))